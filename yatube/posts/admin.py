@@ -1,20 +1,70 @@
 from typing import Tuple
 
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
 
+from posts import moderation, search
+from posts.pagination import EstimatedCountPaginator
 from posts.models import Post, Group, Comment
 
 
-class PostAdmin(admin.ModelAdmin):
+def batch_action(operation, description):
+    """Действие админки, которое выполняет operation пачками."""
+    def action(modeladmin, request, queryset):
+        result = operation(queryset)
+        if isinstance(result, int):
+            summary = str(result)
+        else:
+            summary = ', '.join(f'{label}: {count}' for label, count in result.items())
+        modeladmin.message_user(request, f'{description}: {summary or 0}.')
+    action.__name__ = operation.__name__
+    action.short_description = description
+    return action
+
+
+class BatchModerationMixin:
+    """Без delete_selected: он грузит в память все объекты с каскадами."""
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class LargeTableMixin:
+    """Список объектов большой таблицы без COUNT(*) и DISTINCT по датам."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class FullTextSearchMixin:
+    """Поиск в списке объектов по индексу FTS5 вместо LIKE '%слово%'."""
+    search_index = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.matching(queryset, search_term, self.search_index), False
+
+
+class PostAdmin(BatchModerationMixin, LargeTableMixin, FullTextSearchMixin,
+                admin.ModelAdmin):
     list_display: Tuple[int, str, str, str] = (
         "pk",
         "text",
         "pub_date",
         "author",
         "image",
+        "comment_count",
     )
     search_fields = ("text",)
+    search_index = search.POSTS
+    # Фильтр по дате - фиксированные диапазоны, без запросов к таблице.
     list_filter = ("pub_date",)
+    list_select_related = ("author",)
+    date_hierarchy = "pub_date"
+    actions = [batch_action(moderation.delete_posts, "Удалить пачками")]
     empty_value_display = "-пусто-"
 
 
@@ -29,7 +79,8 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(BatchModerationMixin, LargeTableMixin, FullTextSearchMixin,
+                   admin.ModelAdmin):
     list_display: Tuple[int, str, str, str] = (
         "pk",
         "text",
@@ -38,10 +89,23 @@ class CommentAdmin(admin.ModelAdmin):
         "post",
     )
     search_fields = ("text",)
+    search_index = search.COMMENTS
     list_filter = ("created",)
+    list_select_related = ("author", "post")
+    date_hierarchy = "created"
+    actions = [batch_action(moderation.delete_comments, "Удалить пачками")]
     empty_value_display = "-пусто-"
 
 
+class ModeratedUserAdmin(BatchModerationMixin, UserAdmin):
+    actions = [
+        batch_action(moderation.deactivate_users, "Заблокировать"),
+        batch_action(moderation.delete_users, "Удалить вместе с контентом"),
+    ]
+
+
+admin.site.unregister(User)
+admin.site.register(User, ModeratedUserAdmin)
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
@@ -0,0 +1,200 @@
+"""API только для чтения: посты, группы, профили, комментарии, лента.
+
+Списки листаются курсором теми же паджинаторами, что и HTML-страницы
+(pagination.py), поэтому страница - диапазонный запрос по индексу без
+COUNT(*) и OFFSET. Ответы помечаются ETag по поколению контента, и
+повторный запрос с If-None-Match получает 304 без запросов к постам.
+"""
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.urls import include, path
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import mixins, pagination, permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.routers import DefaultRouter
+from rest_framework.utils.urls import replace_query_param
+
+from . import caching, feeds, stats
+from .models import Comment, Follow, Group, Post, User
+from .pagination import (
+    CURSOR_PARAM, POSTS_PER_PAGE, CursorPaginator, IdCursorPaginator,
+)
+from .serializers import (
+    CommentSerializer, GroupSerializer, PostSerializer, ProfileSerializer,
+)
+
+MAX_PAGE_SIZE = 100
+
+
+class CursorPagination(pagination.BasePagination):
+    """Курсорная навигация на паджинаторах ленты; ?limit= до MAX_PAGE_SIZE."""
+
+    page_size_query_param = 'limit'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return POSTS_PER_PAGE
+        return min(max(size, 1), MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate(
+            lambda per_page: view.cursor_paginator(queryset, per_page), request
+        )
+
+    def paginate(self, make_paginator, request):
+        """Страница запроса; make_paginator(per_page) строит паджинатор."""
+        self.request = request
+        paginator = make_paginator(self.get_page_size(request))
+        token = request.query_params.get(CURSOR_PARAM)
+        self.page = paginator.cursor_page(token) if token else paginator.first_page()
+        return list(self.page)
+
+    def _link(self, token):
+        if token is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, CURSOR_PARAM, token)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+
+def conditional(method):
+    """Отдаёт 304, если ETag представления совпал с If-None-Match."""
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        etag = self.get_etag(request, **kwargs)
+        if etag is None:
+            return method(self, request, *args, **kwargs)
+        etag = quote_etag(etag)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+    return wrapper
+
+
+class ReadOnlyAPIMixin:
+    pagination_class = CursorPagination
+
+    def get_etag(self, request, **kwargs):
+        return caching.feed_etag(request)
+
+    def cursor_paginator(self, queryset, per_page):
+        return CursorPaginator(queryset, per_page)
+
+    def paginated(self, make_paginator, serializer_class=PostSerializer):
+        page = self.paginator.paginate(make_paginator, self.request)
+        serializer = serializer_class(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.paginator.get_paginated_response(serializer.data)
+
+
+class ReadOnlyViewSet(ReadOnlyAPIMixin, viewsets.ReadOnlyModelViewSet):
+    list = conditional(mixins.ListModelMixin.list)
+    retrieve = conditional(mixins.RetrieveModelMixin.retrieve)
+
+
+class PostViewSet(ReadOnlyViewSet):
+    queryset = Post.objects.for_feed()
+    serializer_class = PostSerializer
+
+    @action(detail=True)
+    @conditional
+    def comments(self, request, pk=None):
+        post = self.get_object()
+        queryset = Comment.objects.filter(post=post).select_related('author')
+        return self.paginated(
+            lambda per_page: CursorPaginator(
+                queryset, per_page, key_fields=('created', 'id')
+            ),
+            CommentSerializer,
+        )
+
+
+class GroupViewSet(ReadOnlyViewSet):
+    queryset = Group.objects.all()
+    serializer_class = GroupSerializer
+    lookup_field = 'slug'
+
+    def cursor_paginator(self, queryset, per_page):
+        return IdCursorPaginator(queryset, per_page)
+
+    @action(detail=True)
+    @conditional
+    def posts(self, request, slug=None):
+        group = self.get_object()
+        return self.paginated(
+            lambda per_page: CursorPaginator(group.posts.for_feed(), per_page)
+        )
+
+
+class ProfileViewSet(ReadOnlyAPIMixin, viewsets.GenericViewSet):
+    queryset = User.objects.filter(is_active=True).select_related('stats')
+    serializer_class = ProfileSerializer
+    lookup_field = 'username'
+    lookup_value_regex = '[^/]+'
+    retrieve = conditional(mixins.RetrieveModelMixin.retrieve)
+
+    def get_etag(self, request, username=None, **kwargs):
+        return caching.profile_etag(request, username)
+
+    def get_object(self):
+        user = super().get_object()
+        # Строка счётчиков создаётся при первом обращении.
+        stats.get_stats(user)
+        return user
+
+    @action(detail=True)
+    @conditional
+    def posts(self, request, username=None):
+        author = self.get_object()
+        return self.paginated(
+            lambda per_page: CursorPaginator(
+                author.posts_user.for_feed(), per_page
+            )
+        )
+
+
+class FeedViewSet(ReadOnlyAPIMixin, viewsets.GenericViewSet):
+    """Лента подписок текущего пользователя."""
+
+    serializer_class = PostSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_etag(self, request, **kwargs):
+        # Подписки не меняют поколение контента - учитываем их отдельно.
+        follows = Follow.objects.filter(user=request.user).aggregate(
+            count=Count('pk'), last=Max('pk')
+        )
+        return f'{caching.feed_etag(request)}-{follows["count"]}-{follows["last"]}'
+
+    @conditional
+    def list(self, request):
+        return self.paginated(
+            lambda per_page: feeds.follow_paginator(request.user, per_page)
+        )
+
+
+router = DefaultRouter()
+router.register('posts', PostViewSet, basename='post')
+router.register('groups', GroupViewSet, basename='group')
+router.register('profiles', ProfileViewSet, basename='profile')
+router.register('feed', FeedViewSet, basename='feed')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
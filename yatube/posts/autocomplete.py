@@ -0,0 +1,140 @@
+"""Подсказки по префиксу: имена пользователей и группы.
+
+Индекс живёт в памяти процесса. Это отсортированный список пар
+(слово, id), в котором префикс ищется двоичным поиском, - сжатое
+представление префиксного дерева без узла на каждую букву. Индекс
+строится при первом обращении к нему.
+
+Об изменениях процессы узнают по двум счётчикам в общем кэше. После
+добавления строк каждый процесс дочитывает только строки с pk больше
+последнего известного. После переименования или удаления индекс
+перестраивается целиком.
+"""
+import bisect
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Group, User
+
+MAX_RESULTS = 10
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def extend(self, entries):
+        """Добавляет пачку (id, слова, подсказка) с одной сортировкой.
+
+        Список ключей заменяется новым, поэтому поиск в других потоках
+        не видит его наполовину отсортированным.
+        """
+        keys = list(self._keys)
+        for ident, terms, item in entries:
+            self._items[ident] = item
+            keys.extend((term.casefold(), ident) for term in set(terms))
+        # Хвост из новых ключей timsort сливает со старыми за линейное время.
+        keys.sort()
+        self._keys = keys
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        prefix = prefix.casefold()
+        keys = self._keys
+        found = {}
+        position = bisect.bisect_left(keys, (prefix,))
+        while position < len(keys) and len(found) < limit:
+            term, ident = keys[position]
+            if not term.startswith(prefix):
+                break
+            found.setdefault(ident, self._items[ident])
+            position += 1
+        return list(found.values())
+
+
+class Catalog:
+    """Индекс одной модели и его согласование с базой."""
+
+    def __init__(self, name, queryset, fields, describe, watched=None):
+        self.name = name
+        self.queryset = queryset
+        self.fields = fields
+        self.describe = describe
+        # Поля, при смене которых индекс перестраивается.
+        self.watched = watched or fields
+        self.added_key = f'autocomplete:{name}:added'
+        self.reset_key = f'autocomplete:{name}:reset'
+        self._index = None
+        self._last_pk = 0
+        self._seen = None
+        self._lock = threading.Lock()
+
+    def _state(self):
+        values = cache.get_many([self.added_key, self.reset_key])
+        return values.get(self.added_key), values.get(self.reset_key)
+
+    def _load(self, index, queryset):
+        rows = queryset.order_by('pk').values_list('pk', *self.fields)
+        entries = [(row[0], *self.describe(*row)) for row in rows.iterator()]
+        if entries:
+            index.extend(entries)
+            self._last_pk = entries[-1][0]
+        return index
+
+    def refresh(self):
+        # Состояние читаем до загрузки: изменение во время загрузки
+        # подхватит следующее обращение.
+        state = self._state()
+        with self._lock:
+            if self._index is not None and state == self._seen:
+                return
+            if self._index is None or state[1] != self._seen[1]:
+                # Новый индекс подменяет старый, когда уже собран.
+                self._last_pk = 0
+                self._index = self._load(PrefixIndex(), self.queryset())
+            else:
+                self._load(
+                    self._index, self.queryset().filter(pk__gt=self._last_pk)
+                )
+            self._seen = state
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        self.refresh()
+        return self._index.search(prefix, limit)
+
+    def _bump(self, key):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+
+    def added(self):
+        # После фиксации: иначе другой процесс дочитает индекс раньше,
+        # чем увидит новую строку.
+        transaction.on_commit(lambda: self._bump(self.added_key))
+
+    def changed(self):
+        transaction.on_commit(lambda: self._bump(self.reset_key))
+
+
+def _describe_user(pk, username):
+    return [username], {'id': username, 'text': username}
+
+
+def _describe_group(pk, slug, title):
+    return [slug, *title.split()], {'id': pk, 'text': title, 'slug': slug}
+
+
+users = Catalog(
+    'users', lambda: User.objects.filter(is_active=True),
+    ('username',), _describe_user, watched=('username', 'is_active'),
+)
+groups = Catalog('groups', Group.objects.all, ('slug', 'title'), _describe_group)
+
+CATALOGS = {catalog.name: catalog for catalog in (users, groups)}
+MODELS = {User: users, Group: groups}
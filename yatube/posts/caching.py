@@ -0,0 +1,231 @@
+"""Кэш страниц ленты с инвалидацией по поколению контента.
+
+Любое изменение, видимое в ленте (пост, комментарий, группа),
+увеличивает счётчик поколения. Страница хранится вместе с поколением,
+для которого она собрана, и отдаётся, пока поколение не сменится, так
+что записи в кэше могут жить долго. В режиме stale-while-revalidate
+устаревшую страницу пересобирает один запрос, а остальные в это время
+получают предыдущую версию.
+
+Поколение служит и валидатором условных GET-запросов (ETag): страницы
+групп, профилей и постов отвечают 304, не выполняя шаблон. Гостям эти
+страницы отдаются ещё и с Last-Modified - временем последнего изменения
+контента, подписок или пользователей.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from .models import Follow, UserStats
+
+GENERATION_KEY = 'feed:generation'
+CHANGED_AT_KEY = 'feed:changed_at'
+LOCK_TIMEOUT = 30
+
+counters = {}
+
+
+class HitCounter:
+    """Счётчик попаданий в кэш.
+
+    Копится в памяти процесса и раз в flush_every событий переносится в
+    общий кэш, чтобы итог видели все воркеры (команда cache_stats).
+    """
+
+    def __init__(self, name, flush_every=50):
+        self.name = name
+        self.flush_every = flush_every
+        self._pending = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        counters[name] = self
+
+    def _key(self, kind):
+        return f'hit_counter:{self.name}:{kind}'
+
+    def _record(self, kind):
+        with self._lock:
+            self._pending[kind] += 1
+            if sum(self._pending.values()) < self.flush_every:
+                return
+            pending, self._pending = self._pending, {'hits': 0, 'misses': 0}
+        self._flush(pending)
+
+    def _flush(self, pending):
+        for kind, value in pending.items():
+            if not value:
+                continue
+            key = self._key(kind)
+            try:
+                if not cache.add(key, value, timeout=None):
+                    cache.incr(key, value)
+            except ValueError:
+                # Ключ вытеснили между add и incr - начинаем заново.
+                cache.set(key, value, timeout=None)
+
+    def hit(self):
+        self._record('hits')
+
+    def miss(self):
+        self._record('misses')
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {'hits': 0, 'misses': 0}
+        self._flush(pending)
+
+    def totals(self):
+        """Попадания, промахи и доля попаданий по всем процессам."""
+        self.flush()
+        hits = cache.get(self._key('hits'), 0)
+        misses = cache.get(self._key('misses'), 0)
+        total = hits + misses
+        return hits, misses, hits / total if total else 0.0
+
+
+def _initial_generation():
+    # Не с единицы: после вытеснения ключа поколение не должно совпасть
+    # с тем, под которым уже лежат старые страницы.
+    return int(time.time() * 1000)
+
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, _initial_generation(), timeout=None)
+        current = cache.get(GENERATION_KEY)
+    return current
+
+
+def mark_changed():
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+
+
+def bump_generation():
+    mark_changed()
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, _initial_generation(), timeout=None)
+        return cache.get(GENERATION_KEY)
+
+
+def last_modified(request, *args, **kwargs):
+    """Last-Modified для гостей: время последнего изменения на сайте.
+
+    Вошедшему пользователю дата не отдаётся: его страница зависит от
+    зрителя, и по дате её не отличить от гостевой - ему хватает ETag.
+    """
+    if request.user.is_authenticated:
+        return None
+    changed = cache.get(CHANGED_AT_KEY)
+    if changed is None:
+        # Время вытеснено из кэша - считаем, что всё изменилось сейчас.
+        mark_changed()
+        return None
+    # HTTP-дата точна до секунды: изменение в ту же секунду, что и
+    # ответ, не сдвинуло бы дату, поэтому в эту секунду её не отдаём.
+    if int(changed) >= int(time.time()):
+        return None
+    return datetime.fromtimestamp(changed, timezone.utc)
+
+
+def viewer_key(request):
+    user = request.user
+    return f'u{user.pk}' if user.is_authenticated else 'anon'
+
+
+def page_key(key_prefix, request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'feed_page:{key_prefix}:{viewer_key(request)}:{path}'
+
+
+def _cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+    )
+
+
+def cache_feed_page(key_prefix, timeout=None):
+    """Кэширует GET-ответ представления до смены поколения контента."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = page_key(key_prefix, request)
+            lock_key = f'{key}:lock'
+            current = generation()
+            entry = cache.get(key)
+            locked = False
+            if entry is not None:
+                cached_generation, response = entry
+                if cached_generation == current:
+                    return response
+                if getattr(settings, 'FEED_CACHE_STALE_WHILE_REVALIDATE', True):
+                    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+                    if not locked:
+                        return response
+            try:
+                response = view(request, *args, **kwargs)
+                if _cacheable(response):
+                    cache.set(
+                        key,
+                        (current, response),
+                        timeout or getattr(settings, 'FEED_CACHE_TIMEOUT', None),
+                    )
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+            return response
+        return wrapper
+    return decorator
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _author_counters(username, viewer=None):
+    """Счётчики и имя автора и подписка зрителя на него одним запросом.
+
+    Имя входит в валидатор: сохранение пользователя не меняет поколение
+    контента, а имя показывается на его страницах.
+    """
+    queryset = UserStats.objects.filter(user__username=username)
+    fields = [
+        'posts_count', 'followers_count', 'following_count',
+        'user__first_name', 'user__last_name',
+    ]
+    if viewer is not None and viewer.is_authenticated:
+        queryset = queryset.annotate(following=Exists(
+            Follow.objects.filter(user=viewer, author=OuterRef('user'))
+        ))
+        fields.append('following')
+    return queryset.values_list(*fields).first()
+
+
+def feed_etag(request, *args, **kwargs):
+    """Валидатор ленты без отрисовки: поколение контента и зритель."""
+    return _etag(generation(), viewer_key(request))
+
+
+def profile_etag(request, username, **kwargs):
+    counters = _author_counters(username, request.user)
+    if counters is None:
+        return None
+    return _etag(generation(), viewer_key(request), *counters)
+
+
+def post_etag(request, username, post_id, **kwargs):
+    counters = _author_counters(username)
+    if counters is None:
+        return None
+    return _etag(generation(), viewer_key(request), *counters)
@@ -0,0 +1,182 @@
+"""Потоковая выгрузка постов, комментариев и подписок пользователя.
+
+Записи в том же виде, что принимает импорт (posts.importer), в NDJSON
+или CSV. Строки читаются из базы короткими запросами по chunk_size
+и сразу уходят клиенту, поэтому память не растёт с размером аккаунта,
+а медленный клиент не держит блокировку базы.
+С картинками выгрузка - zip, который собирается на лету: каждый файл
+копируется в архив блоками, а готовые байты архива тут же отдаются.
+"""
+import csv
+import json
+import zipfile
+
+from .models import Comment, Follow, Post
+
+CHUNK_SIZE = 500
+# Мелкие строки склеиваются в куски примерно такого размера.
+BUFFER_SIZE = 64 * 1024
+FORMATS = ('ndjson', 'csv')
+COLUMNS = (
+    'type', 'id', 'post', 'user', 'author', 'group', 'text', 'pub_date',
+    'created', 'image',
+)
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'zip': 'application/zip',
+}
+
+
+def _keyset(queryset, fields, chunk_size):
+    """Строки (pk, *fields) по возрастанию pk, кусок - отдельный запрос.
+
+    Открытый курсор iterator() держал бы разделяемую блокировку SQLite,
+    пока медленный клиент скачивает файл, и запись на сайт стояла бы
+    всё это время. Здесь каждый кусок читается целиком и курсор
+    закрывается до того, как строки уйдут клиенту.
+    """
+    last = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last).order_by('pk')
+            .values_list('pk', *fields)[:chunk_size]
+        )
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield from rows
+
+
+def records(user, chunk_size=CHUNK_SIZE):
+    """Записи пользователя: посты, его комментарии, его подписки."""
+    posts = _keyset(
+        Post.objects.filter(author=user),
+        ('group__slug', 'text', 'pub_date', 'image'), chunk_size,
+    )
+    for pk, slug, text, pub_date, image in posts:
+        record = {'type': 'post', 'id': str(pk), 'author': user.username,
+                  'text': text, 'pub_date': pub_date.isoformat()}
+        if slug:
+            record['group'] = slug
+        if image:
+            record['image'] = image
+        yield record
+    comments = _keyset(
+        Comment.objects.filter(author=user), ('post_id', 'text', 'created'),
+        chunk_size,
+    )
+    for pk, post_id, text, created in comments:
+        yield {'type': 'comment', 'id': str(pk), 'post': str(post_id),
+               'author': user.username, 'text': text,
+               'created': created.isoformat()}
+    follows = _keyset(
+        Follow.objects.filter(user=user), ('author__username',), chunk_size
+    )
+    for _, author in follows:
+        yield {'type': 'follow', 'user': user.username, 'author': author}
+
+
+class _Echo:
+    """csv.writer пишет сюда и получает строку обратно."""
+
+    def write(self, value):
+        return value
+
+
+def _ndjson_lines(rows):
+    for record in rows:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for record in rows:
+        yield writer.writerow([record.get(column, '') for column in COLUMNS])
+
+
+def _chunks(lines):
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def serialize(user, fmt='ndjson', chunk_size=CHUNK_SIZE):
+    """Байты выгрузки в формате fmt, кусками."""
+    lines = _csv_lines if fmt == 'csv' else _ndjson_lines
+    return _chunks(lines(records(user, chunk_size)))
+
+
+class _Sink:
+    """Поток без seek для zipfile: записанное забирается через take()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _archive(user, fmt, chunk_size):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(f'{user.username}.{fmt}', 'w', force_zip64=True) as entry:
+            for data in serialize(user, fmt, chunk_size):
+                entry.write(data)
+                yield sink.take()
+        storage = Post._meta.get_field('image').storage
+        # Один файл может принадлежать нескольким постам - кладём его раз.
+        seen = set()
+        names = _keyset(
+            Post.objects.filter(author=user, image__gt=''), ('image',), chunk_size
+        )
+        for _, name in names:
+            if name in seen:
+                continue
+            seen.add(name)
+            try:
+                source = storage.open(name)
+            except FileNotFoundError:
+                continue
+            # Картинки уже сжаты - храним как есть.
+            info = zipfile.ZipInfo(f'images/{name}')
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(info, 'w', force_zip64=True) as entry:
+                for block in source.chunks(BUFFER_SIZE):
+                    entry.write(block)
+                    yield sink.take()
+    yield sink.take()
+
+
+def stream(user, fmt='ndjson', images=False, chunk_size=CHUNK_SIZE):
+    """Байты выгрузки; с images=True - zip с данными и картинками."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Неизвестный формат: {fmt}')
+    if images:
+        return (data for data in _archive(user, fmt, chunk_size) if data)
+    return serialize(user, fmt, chunk_size)
+
+
+def filename(user, fmt='ndjson', images=False):
+    return f'{user.username}.{"zip" if images else fmt}'
+
+
+def content_type(fmt='ndjson', images=False):
+    return CONTENT_TYPES['zip' if images else fmt]
@@ -0,0 +1,130 @@
+"""Движки ленты подписок (follow_index).
+
+join     - посты выбираются JOIN-ом с Follow на каждый запрос;
+timeline - лента раскладывается по подписчикам при публикации
+           (см. timeline.py);
+pull     - лента собирается при чтении слиянием кэшированных списков
+           последних постов каждого автора.
+
+Движок выбирается настройкой FEED_ENGINE.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import timeline
+from .models import Follow, Post
+from .pagination import CursorPaginator, MergedCursorPaginator, POSTS_PER_PAGE
+
+RECENT_POSTS_LIMIT = 200
+RECENT_POSTS_TIMEOUT = 60 * 60
+
+
+def _recent_key(author_id):
+    return f'feed:recent:{author_id}'
+
+
+def _author_keys(author_id, limit):
+    return list(
+        Post.objects.filter(author_id=author_id)
+        .order_by('-pub_date', '-id')
+        .values_list('pub_date', 'id')[:limit]
+    )
+
+
+def recent_post_keys(author_ids):
+    """Последние ключи (pub_date, id) постов каждого автора из кэша."""
+    cached = cache.get_many([_recent_key(pk) for pk in author_ids])
+    result, missing = {}, {}
+    for author_id in author_ids:
+        keys = cached.get(_recent_key(author_id))
+        if keys is None:
+            keys = _author_keys(author_id, RECENT_POSTS_LIMIT)
+            missing[_recent_key(author_id)] = keys
+        result[author_id] = keys
+    if missing:
+        cache.set_many(missing, RECENT_POSTS_TIMEOUT)
+    return result
+
+
+def invalidate_recent_posts(author_id):
+    cache.delete(_recent_key(author_id))
+
+
+class PullCursorPaginator(MergedCursorPaginator):
+    """Лента подписок, собранная при чтении.
+
+    Списки последних постов авторов сливаются кучей; к базе за
+    ключами обращаемся только для авторов, чей кэшированный список
+    короче, чем нужно для запрошенной страницы.
+    """
+
+    def __init__(self, author_ids, per_page=POSTS_PER_PAGE):
+        self.author_ids = list(author_ids)
+        super().__init__(Post.objects.for_feed(), [], per_page)
+
+    def _author_stream(self, author_id, keys, key, forward, limit):
+        truncated = len(keys) >= RECENT_POSTS_LIMIT
+        if forward:
+            if key is not None:
+                keys = [item for item in keys if item < key]
+            if truncated and len(keys) < limit:
+                keys = self._author_keys_from_db(author_id, key, forward, limit)
+            return keys[:limit]
+        if truncated and key < keys[-1]:
+            return self._author_keys_from_db(author_id, key, forward, limit)
+        return [item for item in reversed(keys) if item > key][:limit]
+
+    def _author_keys_from_db(self, author_id, key, forward, limit):
+        queryset = Post.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        )
+        if key is not None:
+            queryset = queryset.filter(self._seek(key, forward))
+        if not forward:
+            queryset = queryset.reverse()
+        return list(queryset.values_list('pub_date', 'id')[:limit])
+
+    def _merged_keys(self, key, forward, limit):
+        if not self.author_ids:
+            return []
+        if key is None and not forward:
+            # Конец ленты: хвосты всех авторов берём из базы.
+            streams = [
+                self._author_keys_from_db(author_id, None, False, limit)
+                for author_id in self.author_ids
+            ]
+        else:
+            streams = [
+                self._author_stream(author_id, keys, key, forward, limit)
+                for author_id, keys in recent_post_keys(self.author_ids).items()
+            ]
+        return list(islice(heapq.merge(*streams, reverse=forward), limit))
+
+
+def join_paginator(user, per_page=POSTS_PER_PAGE):
+    return CursorPaginator(
+        Post.objects.for_feed().filter(author__following__user=user), per_page
+    )
+
+
+def pull_paginator(user, per_page=POSTS_PER_PAGE):
+    author_ids = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
+    return PullCursorPaginator(author_ids, per_page)
+
+
+ENGINES = {
+    'join': join_paginator,
+    'timeline': timeline.timeline_paginator,
+    'pull': pull_paginator,
+}
+
+
+def follow_paginator(user, per_page=POSTS_PER_PAGE, engine=None):
+    """Паджинатор ленты подписок для выбранного в настройках движка."""
+    engine = engine or getattr(settings, 'FEED_ENGINE', 'timeline')
+    return ENGINES[engine](user, per_page)
@@ -1,7 +1,48 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 
 from .models import Post, Comment
+from .uploads import process_image
+
+
+class AutocompleteSelect(forms.Select):
+    """Список выбора без полного набора вариантов.
+
+    В разметку попадает только выбранный вариант, остальные скрипт
+    подгружает по мере ввода из autocomplete/<kind>/.
+    """
+
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete'] = reverse_lazy(
+            'autocomplete', kwargs={'kind': self.kind}
+        )
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = {str(v) for v in value if v not in (None, '')}
+        choices = []
+        if self.choices.field.empty_label is not None:
+            choices.append(('', self.choices.field.empty_label))
+        if selected:
+            choices.extend(
+                self.choices.choice(obj)
+                for obj in self.choices.queryset.filter(pk__in=selected)
+            )
+        options = [
+            self.create_option(
+                name, option_value, label, str(option_value) in selected
+                or (not selected and option_value == ''), index, attrs=attrs,
+            )
+            for index, (option_value, label) in enumerate(choices)
+        ]
+        return [(None, options, 0)]
 
 
 class PostForm(forms.ModelForm):
@@ -18,6 +59,21 @@ class PostForm(forms.ModelForm):
             'text': _('Введите текст публикации'),
             'image': _('Выберите изображение для публикации'),
         }
+        widgets = {
+            'group': AutocompleteSelect('groups'),
+            'text': forms.Textarea(attrs={
+                'data-mentions': reverse_lazy(
+                    'autocomplete', kwargs={'kind': 'users'}
+                ),
+            }),
+        }
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # При редактировании без новой загрузки здесь уже сохранённый файл.
+        if isinstance(image, UploadedFile):
+            return process_image(image)
+        return image
 
 
 class CommentForm(forms.ModelForm):
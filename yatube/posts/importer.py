@@ -0,0 +1,325 @@
+"""Потоковый импорт постов, комментариев и подписок с других площадок.
+
+Вход - JSONL или CSV, по записи на строку:
+
+    {"type": "post", "id": "p1", "author": "leo", "group": "cats",
+     "text": "...", "pub_date": "2020-01-01T10:00:00Z"}
+    {"type": "comment", "id": "c1", "post": "p1", "author": "ann",
+     "text": "...", "created": "2020-01-02T10:00:00Z"}
+    {"type": "follow", "user": "ann", "author": "leo"}
+
+Записи читаются потоком и вставляются пачками, каждая пачка - одна
+транзакция. Имена пользователей и slug групп разрешаются
+по словарям в памяти. Внешние id постов и комментариев запоминаются в
+ImportedRecord, поэтому повторный импорт того же файла ничего не
+дублирует, а после каждой пачки можно сохранить контрольную точку.
+Запись удалённого поста или комментария остаётся: повторный импорт
+считает его дублем и не возвращает снятое модерацией.
+
+Посты, комментарии и внешние id вставляются одним executemany на
+пачку: на таких объёмах сборка моделей и компиляция bulk_create
+обходятся дороже самой вставки. Сигналы при этом не срабатывают,
+поэтому счётчики, ленты подписчиков и кэши лент обновляются здесь
+же, в транзакции пачки.
+"""
+import csv
+import json
+from collections import Counter, namedtuple
+from itertools import islice
+
+from django.db import connection, models, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import caching, feeds, stats, timeline
+from .models import Comment, Follow, Group, ImportedRecord, Post, User
+
+BATCH_SIZE = 2000
+
+PostRow = namedtuple('PostRow', 'id author_id group_id text pub_date')
+CommentRow = namedtuple('CommentRow', 'id post_id author_id text created')
+RecordRow = namedtuple('RecordRow', 'source kind external_id object_id')
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_jsonl(fileobj):
+    for line in fileobj:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_csv(fileobj):
+    for row in csv.DictReader(fileobj):
+        yield {key: value for key, value in row.items() if value}
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def _date(value):
+    if not value:
+        return timezone.now()
+    moment = parse_datetime(value)
+    if moment is None:
+        raise InvalidRecord(f'Неверная дата: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _lock_for_write():
+    """Блокировка записи с начала транзакции пачки, как BEGIN IMMEDIATE.
+
+    Django открывает транзакции SQLite отложенными, а пачка сначала
+    читает (дубликаты, последний id) и только потом пишет. Любой оператор
+    записи, даже не задевший строк, сразу берёт блокировку.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq WHERE name = ''")
+
+
+def _next_pk(model):
+    """Первый свободный id; id назначаем сами, чтобы связать внешний id
+    с новой строкой.
+
+    На SQLite счётчик берётся из sqlite_sequence, а не Max(pk): AUTOINCREMENT
+    не выдаёт id удалённых строк повторно, и импорт не должен тоже.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name = %s',
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return (row[0] if row else 0) + 1
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def _insert(model, rows):
+    """Вставляет строки-namedtuple (поля названы по attname) одним
+    executemany. Остальные поля модели получают значения по умолчанию."""
+    meta = model._meta
+    fields = [meta.get_field(name) for name in rows[0]._fields]
+    given = {field.attname for field in fields}
+    defaults = [
+        field for field in meta.concrete_fields
+        if field.attname not in given and not field.primary_key
+    ]
+    constants = [field.get_db_prep_save(field.get_default(), connection)
+                 for field in defaults]
+    dates = [
+        index for index, field in enumerate(fields)
+        if isinstance(field, models.DateTimeField)
+    ]
+    quote = connection.ops.quote_name
+    columns = [quote(field.column) for field in fields + defaults]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(meta.db_table), ', '.join(columns), ', '.join(['%s'] * len(columns)),
+    )
+    params = []
+    for row in rows:
+        values = list(row)
+        for index in dates:
+            values[index] = connection.ops.adapt_datetimefield_value(values[index])
+        params.append(values + constants)
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+class Importer:
+    def __init__(self, source='import', batch_size=BATCH_SIZE):
+        self.source = source
+        self.batch_size = batch_size
+        self.users = dict(User.objects.values_list('username', 'pk').iterator())
+        self.groups = dict(Group.objects.values_list('slug', 'pk').iterator())
+        self.result = Counter()
+
+    def run(self, records, start=0, checkpoint=None):
+        """Импортирует записи, пропустив первые start.
+
+        checkpoint(n) вызывается после фиксации каждой пачки с числом
+        обработанных записей. Возвращает Counter по видам записей:
+        вставлено, пропущено как дубликат, отброшено как ошибочное.
+        """
+        records = islice(records, start, None)
+        position = start
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                _lock_for_write()
+                self._import(batch)
+            position += len(batch)
+            if checkpoint is not None:
+                checkpoint(position)
+        caching.bump_generation()
+        return self.result
+
+    def _split(self, batch):
+        kinds = {'post': [], 'comment': [], 'follow': []}
+        for record in batch:
+            kind = record.get('type') if isinstance(record, dict) else None
+            if kind not in kinds:
+                self.result['invalid'] += 1
+                continue
+            kinds[kind].append(record)
+        return kinds
+
+    def _import(self, batch):
+        kinds = self._split(batch)
+        self._import_posts(kinds['post'])
+        self._import_comments(kinds['comment'])
+        self._import_follows(kinds['follow'])
+
+    def _fresh(self, kind, records):
+        """Записи с ещё не импортированными внешними id, без повторов."""
+        ids = {str(record.get('id', '')) for record in records}
+        known = set(ImportedRecord.objects.filter(
+            source=self.source, kind=kind, external_id__in=ids
+        ).values_list('external_id', flat=True))
+        fresh = []
+        for record in records:
+            external_id = str(record.get('id', ''))
+            if not external_id:
+                self.result['invalid'] += 1
+            elif external_id in known:
+                self.result[f'{kind}_duplicates'] += 1
+            else:
+                known.add(external_id)
+                fresh.append((external_id, record))
+        return fresh
+
+    def _remember(self, kind, objects):
+        _insert(ImportedRecord, [
+            RecordRow(self.source, kind, external_id, row.id)
+            for external_id, row in objects
+        ])
+
+    def _build(self, kind, model, records, make):
+        """Новые строки пачки с id подряд после последнего в таблице."""
+        objects = []
+        for external_id, record in self._fresh(kind, records):
+            try:
+                objects.append((external_id, make(record)))
+            except (InvalidRecord, KeyError):
+                self.result['invalid'] += 1
+        if objects:
+            first = _next_pk(model)
+            objects = [
+                (external_id, row._replace(id=first + offset))
+                for offset, (external_id, row) in enumerate(objects)
+            ]
+        return objects
+
+    def _user(self, username):
+        try:
+            return self.users[username]
+        except KeyError:
+            raise InvalidRecord(f'Нет пользователя: {username}')
+
+    def _import_posts(self, records):
+        def make(record):
+            slug = record.get('group')
+            if slug and slug not in self.groups:
+                raise InvalidRecord(f'Нет группы: {slug}')
+            return PostRow(
+                None, self._user(record['author']), self.groups.get(slug),
+                record['text'], _date(record.get('pub_date')),
+            )
+        objects = self._build('post', Post, records, make)
+        if not objects:
+            return
+        posts = [post for _, post in objects]
+        _insert(Post, posts)
+        self._remember('post', objects)
+        for author_id, count in Counter(post.author_id for post in posts).items():
+            stats.bump(author_id, posts_count=count)
+            feeds.invalidate_recent_posts(author_id)
+        if timeline.enabled():
+            timeline.fan_out_many(posts)
+        self.result['posts'] += len(posts)
+
+    def _import_comments(self, records):
+        post_ids = dict(ImportedRecord.objects.filter(
+            source=self.source, kind='post',
+            external_id__in={str(record.get('post', '')) for record in records},
+        ).values_list('external_id', 'object_id'))
+        # Запись импорта могла пережить свой пост - берём только живые.
+        alive = set(Post.objects.filter(pk__in=post_ids.values())
+                    .values_list('pk', flat=True))
+        post_ids = {key: pk for key, pk in post_ids.items() if pk in alive}
+
+        def make(record):
+            post_id = post_ids.get(str(record['post']))
+            if post_id is None:
+                raise InvalidRecord(f'Нет поста: {record["post"]}')
+            return CommentRow(
+                None, post_id, self._user(record['author']), record['text'],
+                _date(record.get('created')),
+            )
+        objects = self._build('comment', Comment, records, make)
+        if not objects:
+            return
+        comments = [comment for _, comment in objects]
+        _insert(Comment, comments)
+        self._remember('comment', objects)
+        # Посты с одинаковым приростом обновляются одним запросом.
+        by_delta = {}
+        for post_id, count in Counter(c.post_id for c in comments).items():
+            by_delta.setdefault(count, []).append(post_id)
+        for count, post_ids in by_delta.items():
+            Post.objects.filter(pk__in=post_ids).update(
+                comment_count=F('comment_count') + count,
+                version=F('version') + 1,
+            )
+        self.result['comments'] += len(comments)
+
+    def _import_follows(self, records):
+        pairs = []
+        for record in records:
+            try:
+                pair = (self._user(record['user']), self._user(record['author']))
+            except (InvalidRecord, KeyError):
+                self.result['invalid'] += 1
+                continue
+            if pair[0] == pair[1]:
+                self.result['invalid'] += 1
+                continue
+            pairs.append(pair)
+        if not pairs:
+            return
+        existing = set(Follow.objects.filter(
+            user_id__in={user for user, _ in pairs},
+            author_id__in={author for _, author in pairs},
+        ).values_list('user_id', 'author_id'))
+        fresh = []
+        for pair in pairs:
+            if pair in existing:
+                self.result['follow_duplicates'] += 1
+            else:
+                existing.add(pair)
+                fresh.append(pair)
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, author_id=author) for user, author in fresh],
+            ignore_conflicts=True,
+        )
+        for user_id, count in Counter(user for user, _ in fresh).items():
+            stats.bump(user_id, following_count=count)
+        for author_id, count in Counter(author for _, author in fresh).items():
+            stats.bump(author_id, followers_count=count)
+        if timeline.enabled():
+            for user_id, author_id in fresh:
+                timeline.backfill(user_id, author_id)
+        self.result['follows'] += len(fresh)
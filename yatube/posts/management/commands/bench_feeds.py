@@ -0,0 +1,141 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from posts import feeds, timeline
+from posts.models import Follow, Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает движки ленты подписок: время и число запросов на '
+        'страницу при проходе ленты курсором. Только для разработки '
+        '(DEBUG=True): замер идёт в одной транзакции, которая держит '
+        'блокировку записи SQLite до конца и откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engines', nargs='+', default=list(feeds.ENGINES),
+            choices=list(feeds.ENGINES),
+        )
+        parser.add_argument('--users', type=int, default=20,
+                            help='Сколько подписчиков взять в выборку.')
+        parser.add_argument('--pages', type=int, default=3,
+                            help='Сколько страниц ленты пройти у каждого.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed-authors', type=int, default=0,
+                            help='Создать синтетический граф подписок '
+                                 '(откатывается после замера).')
+        parser.add_argument('--seed-readers', type=int, default=100)
+        parser.add_argument('--seed-follows', type=int, default=50,
+                            help='Подписок у каждого синтетического читателя.')
+        parser.add_argument('--seed-posts', type=int, default=20,
+                            help='Постов у каждого синтетического автора.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError(
+                'Замер блокирует запись в базу на всё время работы - '
+                'запускайте его только с DEBUG=True, не на рабочем сайте.'
+            )
+        with transaction.atomic():
+            if options['seed_authors']:
+                self.seed(options)
+            if options['seed_authors'] or not timeline.enabled():
+                timeline.rebuild()
+            readers = list(
+                User.objects.filter(follower__isnull=False)
+                .distinct().values_list('pk', flat=True)[:options['users']]
+            )
+            if not readers:
+                self.stderr.write('Нет пользователей с подписками.')
+                return
+            self.stdout.write(
+                f'{len(readers)} читателей, {options["pages"]} стр., '
+                f'{options["repeat"]} повтора'
+            )
+            for engine in options['engines']:
+                self.report(engine, self.measure(engine, readers, options))
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        prefix = f'bench{int(time.time())}'
+        User.objects.bulk_create(
+            User(username=f'{prefix}_a{i}')
+            for i in range(options['seed_authors'])
+        )
+        User.objects.bulk_create(
+            User(username=f'{prefix}_r{i}')
+            for i in range(options['seed_readers'])
+        )
+        # SQLite не возвращает id из bulk_create - перечитываем.
+        authors = list(User.objects.filter(username__startswith=f'{prefix}_a'))
+        readers = list(User.objects.filter(username__startswith=f'{prefix}_r'))
+        Post.objects.bulk_create(
+            (
+                Post(text=f'{prefix} post {i}', author=author)
+                for author in authors
+                for i in range(options['seed_posts'])
+            ),
+            batch_size=500,
+        )
+        follows = min(options['seed_follows'], len(authors))
+        Follow.objects.bulk_create(
+            (
+                Follow(user=reader, author=author)
+                for reader in readers
+                for author in random.sample(authors, follows)
+            ),
+            batch_size=500,
+        )
+
+    def measure(self, engine, readers, options):
+        timings, queries = [], []
+        # Холодный старт только для ключей движка: общий кэш делят все
+        # воркеры, и чистить его целиком нельзя.
+        authors = set(
+            Follow.objects.filter(user_id__in=readers)
+            .values_list('author_id', flat=True)
+        )
+        for author_id in authors:
+            feeds.invalidate_recent_posts(author_id)
+        timeline.forget_celebrities(authors)
+        for _ in range(options['repeat']):
+            for reader in readers:
+                paginator = page = None
+                for _ in range(options['pages']):
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        if page is None:
+                            paginator = feeds.follow_paginator(
+                                User(pk=reader), engine=engine
+                            )
+                            page = paginator.first_page()
+                        else:
+                            page = paginator.page_after(
+                                paginator.key(page.object_list[-1])
+                            )
+                        timings.append(time.perf_counter() - started)
+                    queries.append(len(captured))
+                    if not page.has_next():
+                        break
+        return timings, queries
+
+    def report(self, engine, result):
+        timings, queries = result
+        timings = sorted(t * 1000 for t in timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{engine:>9}: медиана {statistics.median(timings):.2f} мс, '
+            f'p95 {p95:.2f} мс, запросов на страницу '
+            f'{statistics.mean(queries):.1f}'
+        )
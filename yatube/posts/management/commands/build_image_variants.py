@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        'Нарезает варианты картинок постов для srcset по настройке '
+        'POST_IMAGE_VARIANTS; уже готовые пропускает.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true',
+                            help='Пересобрать манифесты всех постов.')
+
+    def handle(self, *args, **options):
+        built, failed = thumbnails.backfill(
+            chunk_size=options['chunk_size'], force=options['force']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Подготовлено постов: {built}.'))
+        if failed:
+            self.stderr.write(f'Не удалось открыть картинки: {failed}.')
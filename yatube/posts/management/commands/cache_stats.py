@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.caching import counters
+from posts.templatetags import post_cards  # noqa: F401 регистрирует счётчик
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэшей по всем воркерам.'
+
+    def handle(self, *args, **options):
+        for name, counter in sorted(counters.items()):
+            hits, misses, ratio = counter.totals()
+            self.stdout.write(
+                f'{name}: попаданий {hits}, промахов {misses}, '
+                f'доля попаданий {ratio:.1%}'
+            )
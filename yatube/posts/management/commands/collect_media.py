@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts import media
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы картинок постов, на которые не ссылается ни один '
+        'пост, вместе с их миниатюрами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float,
+                            default=media.GRACE_PERIOD / 3600,
+                            help='Не трогать файлы моложе этого срока.')
+        parser.add_argument('--batch-size', type=int, default=media.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, что будет удалено.')
+
+    def handle(self, *args, **options):
+        deleted, freed = media.collect_garbage(
+            grace=options['grace_hours'] * 3600,
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {deleted}, освобождено {freed / 1024 / 1024:.1f} МБ.'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает посты, комментарии и подписки пользователя в NDJSON или '
+        'CSV, по желанию - zip вместе с картинками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument('--images', action='store_true',
+                            help='Zip с данными и файлами картинок.')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию stdout).')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['images'] and not options['output']:
+            raise CommandError('Zip с картинками пишется только в файл: укажите --output.')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["username"]}.')
+        chunks = export.stream(
+            user, options['format'], options['images'], options['chunk_size']
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as fileobj:
+                for data in chunks:
+                    fileobj.write(data)
+            return
+        for data in chunks:
+            self.stdout.write(data.decode(), ending='')
@@ -0,0 +1,70 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует посты, комментарии и подписки из JSONL или CSV пачками; '
+        'повторный запуск продолжает с контрольной точки и не создаёт дублей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=tuple(importer.READERS),
+                            help='По умолчанию - по расширению файла.')
+        parser.add_argument('--source', default='import',
+                            help='Площадка, с которой переносятся данные.')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+        parser.add_argument('--checkpoint',
+                            help='Файл контрольной точки (по умолчанию PATH.checkpoint).')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать сначала, не глядя на контрольную точку.')
+
+    def read_checkpoint(self, path, source):
+        try:
+            with open(path) as fileobj:
+                state = json.load(fileobj)
+        except FileNotFoundError:
+            return 0
+        if state.get('source') != source:
+            raise CommandError(f'Контрольная точка {path} от другого источника.')
+        return state['records']
+
+    def write_checkpoint(self, path, source, records):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as fileobj:
+            json.dump({'source': source, 'records': records}, fileobj)
+        os.replace(temporary, path)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'jsonl'
+        )
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        source = options['source']
+        start = 0 if options['restart'] else self.read_checkpoint(checkpoint, source)
+        if start:
+            self.stdout.write(f'Продолжаем с записи {start}.')
+        began = time.monotonic()
+
+        def save(records):
+            self.write_checkpoint(checkpoint, source, records)
+            rate = (records - start) / max(time.monotonic() - began, 1e-6)
+            self.stdout.write(f'{records} записей ({rate:.0f}/с)')
+
+        run = importer.Importer(source=source, batch_size=options['batch_size'])
+        with open(path, newline='', encoding='utf-8') as fileobj:
+            result = run.run(
+                importer.READERS[fmt](fileobj), start=start, checkpoint=save
+            )
+        # Файл обработан целиком - следующий запуск начнёт сначала.
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        summary = ', '.join(f'{key}: {value}' for key, value in sorted(result.items()))
+        self.stdout.write(self.style.SUCCESS(f'Готово. {summary or "нет записей"}.'))
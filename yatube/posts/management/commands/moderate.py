@@ -0,0 +1,49 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import moderation
+from posts.models import Comment, Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет посты и комментарии пользователей (или их самих) пачками, '
+        'каждая пачка - отдельная транзакция.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='+')
+        parser.add_argument('--what', choices=('posts', 'comments', 'all'),
+                            default='all', help='Что удалить.')
+        parser.add_argument('--delete-accounts', action='store_true',
+                            help='Удалить и сами учётные записи.')
+        parser.add_argument('--deactivate', action='store_true',
+                            help='Заблокировать учётные записи.')
+        parser.add_argument('--batch-size', type=int, default=moderation.BATCH_SIZE)
+
+    def progress(self, label, done):
+        self.stdout.write(f'{label}: {done}')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username__in=options['usernames'])
+        missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+        if missing:
+            raise CommandError(f'Нет пользователей: {", ".join(sorted(missing))}')
+        batch = dict(batch_size=options['batch_size'], progress=self.progress)
+        deleted = Counter()
+        if options['delete_accounts']:
+            deleted = moderation.delete_users(users, **batch)
+        else:
+            if options['what'] in ('comments', 'all'):
+                deleted.update(moderation.delete_comments(
+                    Comment.objects.filter(author__in=users), **batch
+                ))
+            if options['what'] in ('posts', 'all'):
+                deleted.update(moderation.delete_posts(
+                    Post.objects.filter(author__in=users), **batch
+                ))
+            if options['deactivate']:
+                moderation.deactivate_users(users, **batch)
+        summary = ', '.join(f'{label}: {count}' for label, count in deleted.items())
+        self.stdout.write(self.style.SUCCESS(f'Удалено: {summary or "ничего"}.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import stats
+
+
+class Command(BaseCommand):
+    help = 'Сверяет Post.comment_count с комментариями и чинит расхождения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=stats.CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать расхождения.')
+
+    def handle(self, *args, **options):
+        repaired = stats.repair_comment_counts(
+            chunk_size=options['chunk_size'], dry_run=options['dry_run']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Исправлено постов: {repaired}.'))
@@ -0,0 +1,107 @@
+"""Счётчики ссылок на файлы картинок и сборка мусора.
+
+Файл картинки (ImageBlob) может принадлежать нескольким постам, поэтому
+при замене или удалении картинки он не удаляется сразу. Сборщик мусора
+обходит дерево хранилища потоково и удаляет файл вместе с миниатюрами,
+только если на него не ссылается ни счётчик, ни один пост и файл не
+менялся дольше GRACE_PERIOD: за это время успевает сохраниться пост,
+чья загрузка совпала с уже лежащим файлом.
+"""
+import os
+import time
+from itertools import islice
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import ImageBlob, Post
+
+GRACE_PERIOD = 60 * 60 * 24
+BATCH_SIZE = 500
+
+
+def _storage():
+    return Post._meta.get_field('image').storage
+
+
+def add_reference(name):
+    if not name:
+        return
+    updated = ImageBlob.objects.filter(name=name).update(
+        refcount=F('refcount') + 1
+    )
+    if not updated:
+        _, created = ImageBlob.objects.get_or_create(
+            name=name, defaults={'refcount': 1}
+        )
+        if not created:
+            ImageBlob.objects.filter(name=name).update(
+                refcount=F('refcount') + 1
+            )
+
+
+def drop_reference(name):
+    if name:
+        ImageBlob.objects.filter(name=name).update(
+            refcount=Greatest(F('refcount') - 1, 0)
+        )
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _delete_blob(storage, name):
+    source = ImageFile(name, storage)
+    # Миниатюры общие для всех постов с этим файлом - удаляем вместе с ним.
+    default.kvstore.delete(source)
+    storage.delete(name)
+    ImageBlob.objects.filter(name=name).delete()
+
+
+def collect_garbage(prefix='posts', grace=GRACE_PERIOD, batch_size=BATCH_SIZE,
+                    dry_run=False):
+    """Удаляет файлы картинок, на которые никто не ссылается.
+
+    Возвращает число удалённых файлов и освобождённых байт.
+    """
+    storage = _storage()
+    deleted = freed = 0
+    for batch in _batches(storage.iter_files(prefix), batch_size):
+        names = [name for name, _, _ in batch]
+        referenced = set(
+            Post.objects.filter(image__in=names).values_list('image', flat=True)
+        )
+        counted = set(
+            ImageBlob.objects.filter(name__in=names, refcount__gt=0)
+            .values_list('name', flat=True)
+        )
+        # Счётчик разошёлся с постами: чиним, а файл удалит следующий проход.
+        drifted = counted - referenced
+        if drifted and not dry_run:
+            ImageBlob.objects.filter(name__in=drifted).update(refcount=0)
+        cutoff = time.time() - grace
+        for name, size, mtime in batch:
+            if name in referenced or name in counted or mtime > cutoff:
+                continue
+            if dry_run:
+                deleted += 1
+                freed += size
+                continue
+            try:
+                # Файл могли только что переиспользовать - проверяем ещё раз.
+                if os.stat(storage.path(name)).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            _delete_blob(storage, name)
+            deleted += 1
+            freed += size
+    return deleted, freed
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.6 on 2026-10-18 04:07
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_count(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    totals = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post')
+    totals = totals.annotate(total=Count('pk')).values('total')
+    Post.objects.update(comment_count=Coalesce(
+        Subquery(totals, output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_comment_count, migrations.RunPython.noop),
+    ]
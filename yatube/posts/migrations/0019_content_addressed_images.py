@@ -0,0 +1,42 @@
+# Generated by Django 2.2.6 on 2026-10-18 04:28
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def fill_image_blobs(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ImageBlob = apps.get_model('posts', 'ImageBlob')
+    rows = (
+        Post.objects.exclude(image='').exclude(image__isnull=True)
+        .order_by().values('image').annotate(total=Count('pk'))
+        .values_list('image', 'total')
+    )
+    ImageBlob.objects.bulk_create(
+        (ImageBlob(name=name, refcount=total) for name, total in rows.iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_image_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(fill_image_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+import posts.search
+
+
+def install_index(apps, schema_editor):
+    posts.search.install(schema_editor.connection, rebuild=True)
+
+
+def uninstall_index(apps, schema_editor):
+    posts.search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.6 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created', '-id'], name='posts_comme_created_17ca0b_idx'),
+        ),
+    ]
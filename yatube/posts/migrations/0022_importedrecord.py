@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_comment_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50)),
+                ('kind', models.CharField(max_length=10)),
+                ('external_id', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'kind', 'external_id')},
+            },
+        ),
+    ]
@@ -1,8 +1,26 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import content_storage
+
 User = get_user_model()
 
+# Поля, которые нужны карточке поста в ленте (includes/post_item.html).
+FEED_FIELDS = (
+    "text",
+    "pub_date",
+    "image",
+    "comment_count",
+    "version",
+    "image_variants",
+    "image_width",
+    "image_height",
+    "image_placeholder",
+    "author__username",
+    "group__title",
+    "group__slug",
+)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -13,8 +31,14 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты: автор и группа одним JOIN, без лишних колонок."""
+        return self.select_related("author", "group").only(*FEED_FIELDS)
+
+
 class Post(models.Model):
-    objects = None
+    objects = PostQuerySet.as_manager()
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
     author = models.ForeignKey(
@@ -29,13 +53,30 @@ class Post(models.Model):
         null=True,
         related_name="posts"
     )
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(
+        upload_to='posts/', storage=content_storage, blank=True, null=True
+    )
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Растёт при каждом изменении карточки поста (см. templatetags/post_cards)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # JSON-манифест готовых размеров картинки (см. posts/thumbnails.py)
+    image_variants = models.TextField(default='', editable=False)
+    # Размеры исходной картинки и крошечное превью (data URI), которые
+    # вычисляются при сохранении, чтобы шаблонам не открывать файл
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(default='', editable=False)
 
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"]),
+            models.Index(fields=["author", "-pub_date", "-id"]),
+            models.Index(fields=["group", "-pub_date", "-id"]),
+        ]
 
 
 class Comment(models.Model):
@@ -55,6 +96,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["post", "-created"]),
+            models.Index(fields=["-created", "-id"]),
+        ]
 
 class Follow(models.Model):
     objects = None
@@ -73,4 +118,80 @@ class Follow(models.Model):
         return f'follower: {self.user} author: {self.author}'
 
     class Meta:
-        unique_together = ['author', 'user']
\ No newline at end of file
+        unique_together = ['author', 'user']
+        indexes = [
+            models.Index(fields=['user', 'author']),
+        ]
+
+class TimelineEntry(models.Model):
+    """Запись в ленте подписок: пост автора, доставленный подписчику."""
+    objects = None
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline"
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries"
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    pub_date = models.DateTimeField("date published")
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post']),
+            models.Index(fields=['user', 'author']),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые показываются на его страницах."""
+    objects = None
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats"
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'stats: {self.user_id}'
+
+
+class ImageBlob(models.Model):
+    """Файл картинки в хранилище по содержимому и число постов с ним."""
+    objects = None
+    name = models.CharField(max_length=100, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.refcount}'
+
+
+class ImportedRecord(models.Model):
+    """Запись, перенесённая командой import_content с другой площадки.
+
+    По ней повторный импорт пропускает уже перенесённое, а комментарии
+    находят свои посты по внешним id.
+    """
+    objects = None
+    source = models.CharField(max_length=50)
+    kind = models.CharField(max_length=10)
+    external_id = models.CharField(max_length=100)
+    object_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'{self.source}:{self.kind}:{self.external_id}'
+
+    class Meta:
+        unique_together = ['source', 'kind', 'external_id']
@@ -0,0 +1,110 @@
+"""Массовая модерация: удаление контента пачками.
+
+Обычное удаление загружает все объекты и их каскады в память и держит
+блокировку SQLite всё время работы. Здесь объекты удаляются пачками
+по BATCH_SIZE, каждая пачка - отдельная короткая транзакция. Зависимые
+строки с большим веером (комментарии к посту, записи лент подписчиков)
+вычищаются такими же пачками заранее, чтобы каскад внутри пачки тоже
+оставался ограниченным. Сигналы post_delete срабатывают как обычно,
+поэтому счётчики, ссылки на картинки и кэши лент остаются согласованными.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from . import autocomplete
+from .models import Comment, Follow, Post, TimelineEntry, User
+
+BATCH_SIZE = 200
+
+
+def _label(model):
+    return model._meta.label
+
+
+def _delete_batches(queryset, batch_size, progress, before=None):
+    """Удаляет строки queryset пачками по возрастанию pk.
+
+    before(ids) вызывается перед удалением пачки, чтобы вычистить
+    зависимые строки. Возвращает Counter удалённых строк по моделям.
+    """
+    deleted = Counter()
+    last_pk = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        last_pk = ids[-1]
+        if before is not None:
+            deleted.update(before(ids))
+        with transaction.atomic():
+            _, per_model = queryset.model.objects.filter(pk__in=ids).delete()
+        deleted.update(per_model)
+        if progress is not None:
+            progress(_label(queryset.model), deleted[_label(queryset.model)])
+
+
+def delete_comments(queryset, batch_size=BATCH_SIZE, progress=None):
+    return _delete_batches(queryset, batch_size, progress)
+
+
+def delete_posts(queryset, batch_size=BATCH_SIZE, progress=None):
+    """Удаляет посты вместе с комментариями и записями лент."""
+    def drain(post_ids):
+        deleted = delete_comments(
+            Comment.objects.filter(post_id__in=post_ids), batch_size, progress
+        )
+        deleted.update(_delete_batches(
+            TimelineEntry.objects.filter(post_id__in=post_ids), batch_size, None
+        ))
+        return deleted
+    return _delete_batches(queryset, batch_size, progress, before=drain)
+
+
+def delete_users(queryset, batch_size=BATCH_SIZE, progress=None):
+    """Удаляет пользователей после их комментариев, постов и подписок."""
+    def drain(user_ids):
+        deleted = delete_comments(
+            Comment.objects.filter(author_id__in=user_ids), batch_size, progress
+        )
+        deleted.update(delete_posts(
+            Post.objects.filter(author_id__in=user_ids), batch_size, progress
+        ))
+        # Подписки удаляем до пользователя: их сигналы поправят счётчики
+        # и ленты остальных пользователей.
+        for field in ('user_id__in', 'author_id__in'):
+            deleted.update(_delete_batches(
+                Follow.objects.filter(**{field: user_ids}), batch_size, progress
+            ))
+        deleted.update(_delete_batches(
+            TimelineEntry.objects.filter(user_id__in=user_ids), batch_size, None
+        ))
+        return deleted
+    return _delete_batches(queryset, batch_size, progress, before=drain)
+
+
+def deactivate_users(queryset, batch_size=BATCH_SIZE, progress=None):
+    """Блокирует пользователей: вход закрыт, подсказки их не показывают.
+
+    Возвращает число заблокированных.
+    """
+    done = 0
+    last_pk = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_pk, is_active=True).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_pk = ids[-1]
+        with transaction.atomic():
+            done += User.objects.filter(pk__in=ids).update(is_active=False)
+            # update() не шлёт сигналов - индекс подсказок сбрасываем сами.
+            autocomplete.users.changed()
+        if progress is not None:
+            progress(_label(User), done)
+    return done
@@ -0,0 +1,302 @@
+import base64
+import binascii
+import hashlib
+import heapq
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+POSTS_PER_PAGE = 10
+# Дальше этого номера ?page=N отдаёт последнюю страницу: смещение
+# считается сканированием индекса, и глубокие номера стоили бы дорого.
+MAX_PAGE_NUMBER = 50
+COUNT_TIMEOUT = 60
+CURSOR_PARAM = 'cursor'
+PAGE_PARAM = 'page'
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, key):
+    """Упаковывает направление и ключ (дата, id) в непрозрачный токен."""
+    pub_date, pk = key
+    raw = json.dumps([direction, pub_date.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, pub_date, pk = json.loads(raw.decode())
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in (FORWARD, BACKWARD) or pub_date is None:
+        raise InvalidCursor(token)
+    return direction, (pub_date, pk)
+
+
+class CursorPage(Page):
+    """Страница ленты, соседние страницы которой адресуются курсором."""
+
+    def __init__(self, object_list, paginator, number=None,
+                 has_next=False, has_previous=False):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage {self.number or "?"}>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1 if self.number else None
+
+    def previous_page_number(self):
+        return self.number - 1 if self.number else None
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(
+            FORWARD, self.paginator.key(self.object_list[-1])
+        )
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(
+            BACKWARD, self.paginator.key(self.object_list[0])
+        )
+
+
+class CursorPaginator(Paginator):
+    """Постраничная навигация по ключу (pub_date, id).
+
+    Каждая страница - это диапазонный запрос по индексу от границы
+    предыдущей страницы, поэтому её стоимость не зависит от глубины и
+    не требует ни COUNT(*), ни OFFSET.
+    """
+
+    def __init__(self, object_list, per_page=POSTS_PER_PAGE,
+                 key_fields=('pub_date', 'id')):
+        self.key_fields = key_fields
+        object_list = object_list.order_by(*(f'-{f}' for f in key_fields))
+        super().__init__(object_list, per_page)
+
+    def key(self, obj):
+        return tuple(getattr(obj, field) for field in self.key_fields)
+
+    def encode_cursor(self, direction, key):
+        return encode_cursor(direction, key)
+
+    def decode_cursor(self, token):
+        return decode_cursor(token)
+
+    def _seek(self, key, forward, key_fields=None):
+        first, second = key_fields or self.key_fields
+        lookup = 'lt' if forward else 'gt'
+        return (
+            Q(**{f'{first}__{lookup}': key[0]})
+            | Q(**{first: key[0], f'{second}__{lookup}': key[1]})
+        )
+
+    def _fetch(self, key=None, forward=True):
+        queryset = self.object_list
+        if key is not None:
+            queryset = queryset.filter(self._seek(key, forward))
+        if not forward:
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        return rows, has_more
+
+    def first_page(self):
+        rows, has_more = self._fetch()
+        return CursorPage(rows, self, number=1, has_next=has_more)
+
+    def last_page(self):
+        rows, has_more = self._fetch(forward=False)
+        return CursorPage(rows, self, has_previous=has_more)
+
+    def page_after(self, key, number=None):
+        rows, has_more = self._fetch(key)
+        return CursorPage(rows, self, number=number,
+                          has_next=has_more, has_previous=True)
+
+    def page_before(self, key):
+        rows, has_more = self._fetch(key, forward=False)
+        if not has_more:
+            # Дошли до начала ленты - отдаём полную первую страницу.
+            return self.first_page()
+        return CursorPage(rows, self, has_next=True, has_previous=True)
+
+    def cursor_page(self, token):
+        try:
+            direction, key = self.decode_cursor(token)
+        except InvalidCursor:
+            return self.first_page()
+        if direction == FORWARD:
+            return self.page_after(key)
+        return self.page_before(key)
+
+    def numbered_page(self, number):
+        """Совместимость со старыми ссылками вида ?page=N.
+
+        Смещение считается один раз по индексу (pub_date, id) без чтения
+        строк, дальше навигация идёт уже курсорами. Номера больше
+        MAX_PAGE_NUMBER ведут на последнюю страницу без смещения.
+        """
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return self.first_page()
+        if number <= 1:
+            return self.first_page()
+        if number > MAX_PAGE_NUMBER:
+            return self.last_page()
+        boundary = self._boundary((number - 1) * self.per_page - 1)
+        if boundary is None:
+            return self.last_page()
+        return self.page_after(boundary, number=number)
+
+    def _boundary(self, offset):
+        keys = self.object_list.values_list(*self.key_fields)[offset:offset + 1]
+        return next(iter(keys), None)
+
+    def get_page(self, number):
+        return self.numbered_page(number)
+
+    def page_for_request(self, request):
+        token = request.GET.get(CURSOR_PARAM)
+        if token:
+            return self.cursor_page(token)
+        return self.numbered_page(request.GET.get(PAGE_PARAM))
+
+
+class IdCursorPaginator(CursorPaginator):
+    """Навигация курсором по одному id - для списков без даты."""
+
+    def __init__(self, object_list, per_page=POSTS_PER_PAGE):
+        super().__init__(object_list, per_page, key_fields=('id',))
+
+    def encode_cursor(self, direction, key):
+        raw = json.dumps([direction, key[0]]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            direction, pk = json.loads(raw.decode())
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise InvalidCursor(token)
+        if direction not in (FORWARD, BACKWARD):
+            raise InvalidCursor(token)
+        return direction, (pk,)
+
+    def _seek(self, key, forward, key_fields=None):
+        return Q(**{f'id__{"lt" if forward else "gt"}': key[0]})
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Лента, собранная слиянием нескольких упорядоченных источников.
+
+    Источник - это queryset и поля его ключа (дата, id поста). Из каждого
+    источника по индексу читаются только ключи, они сливаются кучей, а
+    сами посты выбираются из object_list одним запросом по id.
+    """
+
+    def __init__(self, object_list, sources, per_page=POSTS_PER_PAGE):
+        self.sources = sources
+        super().__init__(object_list, per_page)
+
+    def _merged_keys(self, key, forward, limit):
+        streams = []
+        for queryset, key_fields in self.sources:
+            queryset = queryset.order_by(*(f'-{f}' for f in key_fields))
+            if key is not None:
+                queryset = queryset.filter(self._seek(key, forward, key_fields))
+            if not forward:
+                queryset = queryset.reverse()
+            streams.append(queryset.values_list(*key_fields)[:limit])
+        keys, seen = [], set()
+        for item in heapq.merge(*streams, reverse=forward):
+            if item[1] in seen:
+                continue
+            seen.add(item[1])
+            keys.append(item)
+            if len(keys) == limit:
+                break
+        return keys
+
+    def _fetch(self, key=None, forward=True):
+        keys = self._merged_keys(key, forward, self.per_page + 1)
+        has_more = len(keys) > self.per_page
+        keys = keys[:self.per_page]
+        if not forward:
+            keys.reverse()
+        posts = self.object_list.order_by().in_bulk([pk for _, pk in keys])
+        return [posts[pk] for _, pk in keys if pk in posts], has_more
+
+    def _boundary(self, offset):
+        keys = self._merged_keys(None, True, offset + 1)
+        return keys[offset] if len(keys) > offset else None
+
+
+def paginate(request, object_list, per_page=POSTS_PER_PAGE, **kwargs):
+    """Возвращает паджинатор и текущую страницу ленты для запроса."""
+    paginator = CursorPaginator(object_list, per_page, **kwargs)
+    return paginator, paginator.page_for_request(request)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Паджинатор для админки без COUNT(*) по всей таблице.
+
+    Число строк таблицы без фильтров оценивается по диапазону id: это
+    два чтения из индекса первичного ключа, и удалённые строки только
+    добавляют пустые страницы в конце. Отфильтрованный список считается
+    честно, но результат кэшируется на COUNT_TIMEOUT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return self._estimate(queryset)
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        digest = hashlib.md5(f'{sql}|{params}'.encode()).hexdigest()
+        return cache.get_or_set(
+            f'admin:count:{digest}', queryset.count, COUNT_TIMEOUT
+        )
+
+    def _estimate(self, queryset):
+        ids = queryset.values_list('pk', flat=True)
+        last = ids.order_by('-pk').first()
+        if last is None:
+            return 0
+        return last - ids.order_by('pk').first() + 1
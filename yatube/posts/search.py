@@ -0,0 +1,216 @@
+"""Полнотекстовый поиск по постам и комментариям (SQLite FTS5).
+
+Индекс - внешняя таблица FTS5 поверх posts_post/posts_comment: текст в
+ней не дублируется, а триггеры обновляют индекс в той же транзакции,
+что и строку. Выдача упорядочена по bm25, навигация идёт курсором
+(ранг, id), поэтому страница - это один запрос к индексу с LIMIT и
+один запрос постов по id.
+
+SQLite при изменении схемы таблицы пересоздаёт её и теряет триггеры,
+поэтому после каждой миграции install() проверяет их и, если они
+пропали, восстанавливает триггеры и перестраивает индекс.
+"""
+import base64
+import binascii
+import json
+import re
+from collections import namedtuple
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+
+from .pagination import (
+    BACKWARD, FORWARD, POSTS_PER_PAGE, CursorPaginator, InvalidCursor,
+    paginate,
+)
+
+TOKENIZER = 'unicode61 remove_diacritics 2'
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+# Короткий префикс совпадает с огромным числом слов - ищем его целиком.
+MIN_PREFIX = 3
+
+
+class Index(namedtuple('Index', 'table column')):
+    @property
+    def name(self):
+        return f'{self.table}_fts'
+
+    @property
+    def triggers(self):
+        return [f'{self.name}_{event}' for event in ('insert', 'delete', 'update')]
+
+
+POSTS = Index('posts_post', 'text')
+COMMENTS = Index('posts_comment', 'text')
+INDEXES = (POSTS, COMMENTS)
+
+
+def available(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def _statements(index):
+    table, column, fts = index.table, index.column, index.name
+    insert, delete, update = index.triggers
+    add = f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});'
+    remove = (f"INSERT INTO {fts}({fts}, rowid, {column}) "
+              f"VALUES ('delete', old.id, old.{column});")
+    yield (f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+           f"{column}, content='{table}', content_rowid='id', "
+           f"tokenize='{TOKENIZER}')")
+    yield (f'CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} '
+           f'BEGIN {add} END')
+    yield (f'CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} '
+           f'BEGIN {remove} END')
+    # Счётчики и версия поста меняются часто - индекс трогаем только
+    # при смене текста.
+    yield (f'CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {column} '
+           f'ON {table} WHEN old.{column} IS NOT new.{column} '
+           f'BEGIN {remove} {add} END')
+
+
+def install(connection, rebuild=False):
+    """Создаёт индексы и триггеры, если их нет.
+
+    Индекс перестраивается по таблице, если триггеров не было: без них
+    он мог отстать от данных.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for index in INDEXES:
+            if index.table not in tables:
+                continue
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                'AND name IN (%s, %s, %s)', index.triggers,
+            )
+            complete = cursor.fetchone()[0] == len(index.triggers)
+            for statement in _statements(index):
+                cursor.execute(statement)
+            if rebuild or not complete:
+                cursor.execute(
+                    f"INSERT INTO {index.name}({index.name}) VALUES ('rebuild')"
+                )
+
+
+def uninstall(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for index in INDEXES:
+            for trigger in index.triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {index.name}')
+
+
+def build_query(text):
+    """Запрос FTS5 из пользовательского ввода.
+
+    Слова берутся в кавычки, поэтому синтаксис FTS5 в вводе не
+    срабатывает; последнее слово ищется как префикс.
+    """
+    terms = TERM_RE.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return ''
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= MIN_PREFIX:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def matching(queryset, text, index=POSTS):
+    """Строки queryset, подходящие под запрос, без ранжирования."""
+    query = build_query(text)
+    if not query:
+        return queryset.none()
+    if not available(queryset.db):
+        condition = Q()
+        for term in TERM_RE.findall(text)[:MAX_TERMS]:
+            condition &= Q(**{f'{index.column}__icontains': term})
+        return queryset.filter(condition)
+    # Не pk__in=RawSQL(...): Django обернёт подзапрос во вторые скобки,
+    # и SQLite сочтёт его скалярным, вернув только первое совпадение.
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        where=[f'"{table}"."id" IN (SELECT rowid FROM {index.name} '
+               f'WHERE {index.name} MATCH %s)'],
+        params=[query],
+    )
+
+
+class SearchPaginator(CursorPaginator):
+    """Выдача поиска по рангу bm25; ключ страницы - (ранг, id)."""
+
+    def __init__(self, object_list, query, per_page=POSTS_PER_PAGE,
+                 index=POSTS):
+        self.query = query
+        self.index = index
+        self.key_fields = ('search_rank', 'id')
+        Paginator.__init__(self, object_list.order_by(), per_page)
+
+    def _check_object_list_is_ordered(self):
+        # Порядок задаёт индекс, а не queryset.
+        pass
+
+    def encode_cursor(self, direction, key):
+        raw = json.dumps([direction, *key]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            direction, rank, pk = json.loads(raw.decode())
+            rank, pk = float(rank), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise InvalidCursor(token)
+        if direction not in (FORWARD, BACKWARD):
+            raise InvalidCursor(token)
+        return direction, (rank, pk)
+
+    def _keys(self, limit, key=None, forward=True, offset=0):
+        fts = self.index.name
+        sql = f'SELECT rank, rowid FROM {fts} WHERE {fts} MATCH %s'
+        params = [self.query]
+        if key is not None:
+            rank_op, id_op = ('>', '<') if forward else ('<', '>')
+            sql += f' AND (rank {rank_op} %s OR (rank = %s AND rowid {id_op} %s))'
+            params += [key[0], key[0], key[1]]
+        # Лучший ранг в bm25 - наименьший; при равенстве новее выше.
+        sql += ' ORDER BY rank, rowid DESC' if forward else ' ORDER BY rank DESC, rowid'
+        sql += ' LIMIT %s OFFSET %s'
+        params += [limit, offset]
+        with connections[self.object_list.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _fetch(self, key=None, forward=True):
+        keys = self._keys(self.per_page + 1, key, forward)
+        has_more = len(keys) > self.per_page
+        keys = keys[:self.per_page]
+        if not forward:
+            keys.reverse()
+        posts = self.object_list.in_bulk([pk for _, pk in keys])
+        rows = []
+        for rank, pk in keys:
+            if pk in posts:
+                posts[pk].search_rank = rank
+                rows.append(posts[pk])
+        return rows, has_more
+
+    def _boundary(self, offset):
+        keys = self._keys(1, offset=offset)
+        return tuple(keys[0]) if keys else None
+
+
+def search(request, queryset, text, per_page=POSTS_PER_PAGE):
+    """Паджинатор и страница выдачи поиска по тексту постов."""
+    query = build_query(text)
+    if query and available(queryset.db):
+        paginator = SearchPaginator(queryset, query, per_page)
+        return paginator, paginator.page_for_request(request)
+    # Без FTS5 - подстрока по всем словам, свежие посты первыми.
+    return paginate(request, matching(queryset, text), per_page)
@@ -0,0 +1,69 @@
+from rest_framework import serializers
+
+from .models import Comment, Group, Post, User
+
+FIELDS_PARAM = 'fields'
+
+
+class SparseFieldsMixin:
+    """?fields=id,text - в ответе остаются только перечисленные поля."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        requested = request.query_params.get(FIELDS_PARAM)
+        if not requested:
+            return
+        wanted = {name.strip() for name in requested.split(',')}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    author = serializers.CharField(source='author.username', read_only=True)
+    group = serializers.CharField(source='group.slug', read_only=True, allow_null=True)
+
+    class Meta:
+        model = Post
+        fields = (
+            'id', 'text', 'pub_date', 'author', 'group', 'image',
+            'image_width', 'image_height', 'comment_count',
+        )
+        read_only_fields = fields
+
+
+class GroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ('id', 'title', 'slug', 'description')
+        read_only_fields = fields
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    post = serializers.IntegerField(source='post_id', read_only=True)
+    author = serializers.CharField(source='author.username', read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ('id', 'post', 'author', 'text', 'created')
+        read_only_fields = fields
+
+
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    posts_count = serializers.IntegerField(source='stats.posts_count', read_only=True)
+    followers_count = serializers.IntegerField(
+        source='stats.followers_count', read_only=True
+    )
+    following_count = serializers.IntegerField(
+        source='stats.following_count', read_only=True
+    )
+
+    class Meta:
+        model = User
+        fields = (
+            'username', 'first_name', 'last_name', 'posts_count',
+            'followers_count', 'following_count',
+        )
+        read_only_fields = fields
@@ -0,0 +1,177 @@
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete, post_init, post_migrate, post_save, pre_save,
+)
+from django.dispatch import receiver
+
+from . import (
+    autocomplete, caching, feeds, media, search, stats, thumbnails, timeline,
+)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(pre_save, sender=Post)
+def fill_image_metadata(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if not instance.image:
+        thumbnails.clear_metadata(instance)
+    elif not instance.image._committed:
+        # Новый файл ещё не записан в хранилище - читаем его из загрузки.
+        thumbnails.fill_metadata(instance, instance.image.file)
+
+
+def _image_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Post)
+def remember_image(sender, instance, **kwargs):
+    # Отложенное поле не трогаем, чтобы не делать лишний запрос.
+    instance._saved_image = _image_name(instance.__dict__.get('image'))
+
+
+@receiver(post_save, sender=Post)
+def count_image_reference(sender, instance, created, raw=False, **kwargs):
+    if raw or 'image' not in instance.__dict__:
+        return
+    name = _image_name(instance.image)
+    previous = '' if created else instance._saved_image
+    if name != previous:
+        media.add_reference(name)
+        media.drop_reference(previous)
+        instance._saved_image = name
+
+
+@receiver(post_delete, sender=Post)
+def drop_image_reference(sender, instance, **kwargs):
+    media.drop_reference(instance._saved_image)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and timeline.enabled():
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Post)
+def bump_post_version(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        Post.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+        # Иначе повторный save() того же объекта запишет старую версию.
+        instance.refresh_from_db(fields=['version'])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_recent_posts(sender, instance, **kwargs):
+    feeds.invalidate_recent_posts(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    stats.bump(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    stats.bump_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, followers_count=1)
+        stats.bump(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    stats.bump(instance.author_id, followers_count=-1)
+    stats.bump(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and timeline.enabled():
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def drop_from_timeline(sender, instance, **kwargs):
+    timeline.drop(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_feed_generation(sender, **kwargs):
+    caching.bump_generation()
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def mark_pages_changed(sender, **kwargs):
+    # Подписки и имена видны на страницах, но не меняют поколение ленты.
+    caching.mark_changed()
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    # Пересоздание таблицы в миграции удаляет триггеры поискового индекса.
+    if sender.name == 'posts':
+        search.install(connections[using])
+
+
+def _suggested(instance, fields):
+    return tuple(instance.__dict__.get(field) for field in fields)
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Group)
+def remember_suggested(sender, instance, **kwargs):
+    catalog = autocomplete.MODELS[sender]
+    instance._suggested = _suggested(instance, catalog.watched)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def update_suggestions(sender, instance, created, **kwargs):
+    catalog = autocomplete.MODELS[sender]
+    current = _suggested(instance, catalog.watched)
+    if created:
+        catalog.added()
+    elif current != instance._suggested:
+        # Вход пользователя меняет только last_login - индекс не трогаем.
+        catalog.changed()
+    instance._suggested = current
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def drop_suggestions(sender, instance, **kwargs):
+    autocomplete.MODELS[sender].changed()
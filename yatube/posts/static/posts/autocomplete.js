@@ -0,0 +1,98 @@
+// Подсказки для формы поста: группы и упоминания @пользователей
+// подгружаются с сервера по мере ввода, а не встраиваются в страницу.
+(function () {
+    'use strict';
+
+    var DELAY = 150;
+
+    function debounce(fn) {
+        var timer = null;
+        return function () {
+            var args = arguments, self = this;
+            clearTimeout(timer);
+            timer = setTimeout(function () { fn.apply(self, args); }, DELAY);
+        };
+    }
+
+    function suggest(url, query) {
+        return fetch(url + '?q=' + encodeURIComponent(query), {
+            headers: {'Accept': 'application/json'},
+            credentials: 'same-origin'
+        }).then(function (response) {
+            return response.ok ? response.json() : {results: []};
+        }).then(function (data) { return data.results; });
+    }
+
+    function setupSelect(select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control mb-1';
+        input.placeholder = 'Начните вводить название';
+        select.parentNode.insertBefore(input, select);
+        input.addEventListener('input', debounce(function () {
+            var query = input.value.trim();
+            if (!query) {
+                return;
+            }
+            suggest(select.dataset.autocomplete, query).then(function (results) {
+                Array.prototype.slice.call(select.options).forEach(function (option) {
+                    if (option.value && !option.selected) {
+                        select.removeChild(option);
+                    }
+                });
+                results.forEach(function (item) {
+                    if (select.querySelector('option[value="' + item.id + '"]')) {
+                        return;
+                    }
+                    select.appendChild(new Option(item.text, item.id));
+                });
+                select.size = Math.min(select.options.length, 8);
+            });
+        }));
+        select.addEventListener('change', function () { select.size = 0; });
+    }
+
+    function setupMentions(textarea) {
+        var list = document.createElement('div');
+        list.className = 'list-group';
+        textarea.parentNode.insertBefore(list, textarea.nextSibling);
+
+        function mention() {
+            var before = textarea.value.slice(0, textarea.selectionStart);
+            var match = /(^|\s)@(\w+)$/.exec(before);
+            return match ? match[2] : null;
+        }
+
+        function insert(username) {
+            var position = textarea.selectionStart;
+            var before = textarea.value.slice(0, position).replace(/@\w+$/, '@' + username + ' ');
+            textarea.value = before + textarea.value.slice(position);
+            textarea.selectionStart = textarea.selectionEnd = before.length;
+            list.innerHTML = '';
+            textarea.focus();
+        }
+
+        textarea.addEventListener('input', debounce(function () {
+            var query = mention();
+            list.innerHTML = '';
+            if (!query) {
+                return;
+            }
+            suggest(textarea.dataset.mentions, query).then(function (results) {
+                results.forEach(function (item) {
+                    var button = document.createElement('button');
+                    button.type = 'button';
+                    button.className = 'list-group-item list-group-item-action';
+                    button.textContent = '@' + item.text;
+                    button.addEventListener('click', function () { insert(item.id); });
+                    list.appendChild(button);
+                });
+            });
+        }));
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('select[data-autocomplete]').forEach(setupSelect);
+        document.querySelectorAll('textarea[data-mentions]').forEach(setupMentions);
+    });
+})();
@@ -0,0 +1,133 @@
+"""Денормализованные счётчики: UserStats и Post.comment_count.
+
+Счётчики меняются F()-выражениями в той же транзакции, что и пост,
+подписка или комментарий, поэтому страницы читают готовые значения
+вместо COUNT(*). Разошедшиеся значения чинят команды recount_stats и
+reconcile_comment_counts.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Comment, Follow, Post, User, UserStats
+
+COUNTERS = ('posts_count', 'followers_count', 'following_count')
+CHUNK_SIZE = 1000
+
+
+def actual_counts(user_ids):
+    """Фактические значения счётчиков для пачки пользователей."""
+    result = {pk: dict.fromkeys(COUNTERS, 0) for pk in user_ids}
+    sources = (
+        ('posts_count', Post.objects.filter(author_id__in=user_ids), 'author_id'),
+        ('followers_count', Follow.objects.filter(author_id__in=user_ids), 'author_id'),
+        ('following_count', Follow.objects.filter(user_id__in=user_ids), 'user_id'),
+    )
+    for counter, queryset, field in sources:
+        totals = queryset.order_by().values(field).annotate(total=Count('pk'))
+        for pk, total in totals.values_list(field, 'total'):
+            result[pk][counter] = total
+    return result
+
+
+def recount(user_id):
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id, defaults=actual_counts([user_id])[user_id]
+    )
+    return stats
+
+
+def get_stats(user):
+    """Счётчики пользователя; строка создаётся при первом обращении."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return recount(user.pk)
+
+
+def bump(user_id, **deltas):
+    updated = UserStats.objects.filter(user_id=user_id).update(**{
+        counter: Greatest(F(counter) + delta, 0)
+        for counter, delta in deltas.items()
+    })
+    # Строки нет: при росте считаем её заново, при уменьшении (например,
+    # в каскаде удаления пользователя) её досчитает первое чтение.
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        recount(user_id)
+
+
+def repair(chunk_size=CHUNK_SIZE, dry_run=False):
+    """Пересчитывает счётчики всех пользователей пачками по chunk_size.
+
+    Каждая пачка - отдельная короткая транзакция. Возвращает число
+    исправленных и созданных строк.
+    """
+    repaired = created = 0
+    last_pk = 0
+    while True:
+        user_ids = list(
+            User.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not user_ids:
+            break
+        last_pk = user_ids[-1]
+        with transaction.atomic():
+            counts = actual_counts(user_ids)
+            existing = UserStats.objects.in_bulk(user_ids)
+            drifted, missing = [], []
+            for pk, values in counts.items():
+                stats = existing.get(pk)
+                if stats is None:
+                    missing.append(UserStats(user_id=pk, **values))
+                    continue
+                if any(getattr(stats, c) != v for c, v in values.items()):
+                    for counter, value in values.items():
+                        setattr(stats, counter, value)
+                    drifted.append(stats)
+            if not dry_run:
+                UserStats.objects.bulk_update(drifted, COUNTERS)
+                UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+        repaired += len(drifted)
+        created += len(missing)
+    return repaired, created
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=Greatest(F('comment_count') + delta, 0),
+        version=F('version') + 1,
+    )
+
+
+def repair_comment_counts(chunk_size=CHUNK_SIZE, dry_run=False):
+    """Сверяет Post.comment_count с таблицей комментариев пачками.
+
+    Возвращает число исправленных постов.
+    """
+    repaired = 0
+    last_pk = 0
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('comment_count')[:chunk_size]
+        )
+        if not posts:
+            break
+        last_pk = posts[-1].pk
+        with transaction.atomic():
+            totals = dict(
+                Comment.objects.filter(post__in=posts).order_by()
+                .values('post').annotate(total=Count('pk'))
+                .values_list('post', 'total')
+            )
+            drifted = []
+            for post in posts:
+                actual = totals.get(post.pk, 0)
+                if post.comment_count != actual:
+                    post.comment_count = actual
+                    drifted.append(post)
+            if not dry_run:
+                Post.objects.bulk_update(drifted, ['comment_count'])
+        repaired += len(drifted)
+    return repaired
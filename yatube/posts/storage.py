@@ -0,0 +1,67 @@
+"""Хранилище картинок постов с именами по содержимому.
+
+Файл сохраняется под именем posts/ab/cd/<sha256>.<ext>, поэтому
+одинаковые загрузки занимают место один раз, а sorl-thumbnail, который
+строит имена миниатюр по имени исходника, нарезает их тоже один раз.
+Ссылки постов на файлы считает posts/media.py, там же сборка мусора.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя выбирает _save по содержимому; одинаковое имя
+        # означает тот же самый файл.
+        return name
+
+    def hashed_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        ).replace('\\', '/')
+
+    def _save(self, name, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        name = self.hashed_name(name, sha256.hexdigest())
+        try:
+            # Такой файл уже есть: обновляем время изменения, чтобы сборщик
+            # мусора не удалил его, пока новый пост ещё не сохранён.
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+        # Пишем во временный файл и переименовываем: параллельная загрузка
+        # тех же байтов просто заменит файл идентичным.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+    def iter_files(self, prefix):
+        """Файлы под prefix по одному: имя, размер и время изменения."""
+        stack = [prefix]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = os.scandir(self.path(directory))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    name = f'{directory}/{entry.name}'
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(name)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat()
+                        yield name, stat.st_size, stat.st_mtime
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,107 @@
+"""Навигация по датам в списке объектов админки через индекс.
+
+Стандартный date_hierarchy строит годы, месяцы и дни запросом
+SELECT DISTINCT по всем строкам уровня. Здесь границы берутся двумя
+чтениями из индекса по полю даты, а каждый кандидат (год, месяц,
+день) проверяется запросом EXISTS по диапазону того же индекса.
+"""
+import datetime
+
+from django import template
+from django.conf import settings
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.utils import timezone
+
+register = template.Library()
+
+
+def _moment(day):
+    moment = datetime.datetime.combine(day, datetime.time.min)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+def _next_month(day):
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def _present(queryset, field, starts, stop):
+    """Начала периодов, в которых есть хотя бы одна строка."""
+    bounds = list(starts) + [stop]
+    return [
+        start for start, end in zip(bounds, bounds[1:])
+        if queryset.filter(**{
+            f'{field}__gte': _moment(start), f'{field}__lt': _moment(end),
+        }).exists()
+    ]
+
+
+def _edge(queryset, field, descending=False):
+    value = (
+        queryset.order_by(f'-{field}' if descending else field)
+        .values_list(field, flat=True).first()
+    )
+    if value is not None and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value
+
+
+class IndexedDates:
+    """Замена queryset для date_hierarchy: те же aggregate и dates,
+    но через чтения из индекса."""
+
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+
+    def aggregate(self, first, last):
+        return {
+            'first': _edge(self.queryset, self.field),
+            'last': _edge(self.queryset, self.field, descending=True),
+        }
+
+    def dates(self, field, kind):
+        first = _edge(self.queryset, field)
+        if first is None:
+            return []
+        last = _edge(self.queryset, field, descending=True)
+        first, last = first.date(), last.date()
+        if kind == 'year':
+            starts = [datetime.date(year, 1, 1) for year in range(first.year, last.year + 1)]
+            stop = datetime.date(last.year + 1, 1, 1)
+        elif kind == 'month':
+            starts, month = [], first.replace(day=1)
+            while month <= last:
+                starts.append(month)
+                month = _next_month(month)
+            stop = month
+        else:
+            starts = [
+                first + datetime.timedelta(days=offset)
+                for offset in range((last - first).days + 1)
+            ]
+            stop = last + datetime.timedelta(days=1)
+        return _present(self.queryset, field, starts, stop)
+
+
+class IndexedChangeList:
+    def __init__(self, cl):
+        self._cl = cl
+        self.queryset = IndexedDates(cl.queryset, cl.date_hierarchy)
+
+    def __getattr__(self, name):
+        return getattr(self._cl, name)
+
+
+def indexed_date_hierarchy(cl):
+    return date_hierarchy(IndexedChangeList(cl))
+
+
+@register.tag(name='indexed_date_hierarchy')
+def indexed_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser, token,
+        func=indexed_date_hierarchy,
+        template_name='date_hierarchy.html',
+        takes_context=False,
+    )
@@ -0,0 +1,88 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+from posts.caching import HitCounter
+
+register = template.Library()
+
+# Место в общей части карточки, куда вставляется ссылка для автора.
+EDIT_LINK_SLOT = '<!-- post-edit-link -->'
+
+card_counter = HitCounter('post_card')
+
+
+def card_key(post):
+    """Ключ карточки: id и версия поста плюс данные автора и группы,
+    которые меняются отдельно от строки поста. Дата публикации не даёт
+    спутать пост с удалённым, если id будет использован повторно."""
+    group = post.group
+    related = '|'.join((
+        post.pub_date.isoformat(),
+        post.author.username,
+        group.slug if group else '',
+        group.title if group else '',
+    ))
+    digest = hashlib.md5(related.encode()).hexdigest()[:12]
+    return f'post_card:{post.pk}:{post.version}:{digest}'
+
+
+def prefetch_cards(posts):
+    """Достаёт из кэша карточки всех постов страницы одним get_many.
+
+    Результат запоминается на объектах постов, поэтому тег post_card на
+    этой странице в кэш уже не ходит.
+    """
+    posts = list(posts)
+    keys = [card_key(post) for post in posts]
+    found = cache.get_many(keys)
+    for key, post in zip(keys, posts):
+        post._prefetched_card = (key, found.get(key))
+
+
+def render_card(post):
+    prefetched = getattr(post, '_prefetched_card', None)
+    if prefetched is None:
+        key = card_key(post)
+        html = cache.get(key)
+    else:
+        key, html = prefetched
+    if html is not None:
+        card_counter.hit()
+        return html
+    card_counter.miss()
+    html = render_to_string('includes/post_card.html', {
+        'post': post,
+        'edit_link_slot': mark_safe(EDIT_LINK_SLOT),
+    })
+    cache.set(key, html, getattr(settings, 'POST_CARD_CACHE_TIMEOUT', None))
+    return html
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    """Карточка поста: общая для всех зрителей часть берётся из кэша,
+    ссылка «Редактировать» подставляется для автора отдельно."""
+    html = render_card(post)
+    user = context.get('user')
+    edit_link = ''
+    if user is not None and user.is_authenticated and user.pk == post.author_id:
+        edit_link = render_to_string('includes/post_edit_link.html', {'post': post})
+    return mark_safe(html.replace(EDIT_LINK_SLOT, edit_link))
+
+
+@register.simple_tag
+def post_image(post):
+    """srcset карточки из манифеста поста или None; недостающие варианты
+    ставит в очередь."""
+    if not post.image:
+        return None
+    sources = thumbnails.image_sources(post)
+    if sources is None:
+        thumbnails.schedule(post)
+    return sources
@@ -1,16 +1,39 @@
+import multiprocessing
+import os
+import re
 import tempfile
+import threading
+import time
+import csv
 import io
+import json
+import zipfile
+from datetime import datetime, timezone
 from unittest import mock
 from PIL import Image
 
-from django.contrib.auth.models import User
-from django.core.cache import cache
-from django.test import Client, TestCase, override_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.base import ContentFile
 from django.core.files.base import File
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from .models import Post, Group, Follow, Comment
+from yatube.cache_backends import LocalLRU, SQLiteCache, TwoLevelCache
+
+from . import (
+    autocomplete, caching, export, feeds, importer, media, moderation, search,
+    stats, thumbnails, timeline, uploads,
+)
+from .forms import PostForm
+from .templatetags import post_cards
+from .models import (
+    Post, Group, Follow, Comment, ImageBlob, ImportedRecord, TimelineEntry, UserStats,
+)
 
 
 class TestStringMethods(TestCase):
@@ -235,7 +258,8 @@ class PostTestList(TestCase):
         self.assertFormError(response, form='form', field='image', errors=error)
 
     def test_index_cache(self):
-        """Проверка работы кэша."""
+        """Проверка работы кэша: новый пост сразу сбрасывает главную страницу."""
+        self.client.get(reverse('index'))
         self.client.post(
             reverse('new_post'),
             data={
@@ -245,9 +269,6 @@ class PostTestList(TestCase):
             follow=True
         )
         response = self.client.get(reverse('index'))
-        self.assertNotContains(response, 'test index cache', status_code=200)
-        cache.clear()
-        response = self.client.get(reverse('index'))
         self.assertContains(response, 'test index cache', count=1, status_code=200)
 
 
@@ -368,3 +389,1533 @@ class TestFollowComment(TestCase):
         count_new_comment = Comment.objects.filter(text='Very strange post!').count()
         self.assertEqual(count_new_comment, 0)
 
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='alice', password='alice123')
+        Post.objects.bulk_create(
+            Post(text=f'cursor post {i}', author=self.author) for i in range(25)
+        )
+        # Одинаковая дата у части постов: порядок должен держаться на id.
+        Post.objects.filter(pk__in=Post.objects.order_by('pk').values('pk')[:10]).update(
+            pub_date=Post.objects.order_by('pk').first().pub_date
+        )
+        self.expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list('id', flat=True)
+        )
+
+    def page_ids(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        page = response.context['page']
+        return page, [post.id for post in page]
+
+    def test_cursor_walks_whole_feed(self):
+        """Курсоры проходят ленту вперёд и назад без пропусков и повторов."""
+        url = reverse('profile', kwargs={'username': 'alice'})
+        page, ids = self.page_ids(url)
+        pages, seen = [ids], list(ids)
+        while page.has_next():
+            page, ids = self.page_ids(url, {'cursor': page.next_cursor})
+            pages.append(ids)
+            seen += ids
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([len(ids) for ids in pages], [10, 10, 5])
+        page, ids = self.page_ids(url, {'cursor': page.previous_cursor})
+        self.assertEqual(ids, pages[1])
+        page, ids = self.page_ids(url, {'cursor': page.previous_cursor})
+        self.assertEqual(ids, pages[0])
+        self.assertFalse(page.has_previous())
+
+    def test_page_number_compatibility(self):
+        """Старые ссылки ?page=N продолжают работать."""
+        url = reverse('profile', kwargs={'username': 'alice'})
+        page, ids = self.page_ids(url, {'page': 2})
+        self.assertEqual(ids, self.expected[10:20])
+        self.assertEqual(page.number, 2)
+        with CaptureQueriesContext(connection) as queries:
+            page, ids = self.page_ids(url, {'page': 5000})
+        self.assertEqual(ids, self.expected[-10:])
+        self.assertFalse(page.has_next())
+        self.assertFalse([q for q in queries.captured_queries if 'OFFSET' in q['sql']])
+        page, ids = self.page_ids(url, {'page': 'abc'})
+        self.assertEqual(ids, self.expected[:10])
+
+    def test_invalid_cursor_returns_first_page(self):
+        url = reverse('profile', kwargs={'username': 'alice'})
+        page, ids = self.page_ids(url, {'cursor': 'garbage!'})
+        self.assertEqual(ids, self.expected[:10])
+
+    def test_cursor_page_skips_count(self):
+        """Страница по курсору не выполняет COUNT(*)."""
+        page, ids = self.page_ids(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'), {'cursor': page.next_cursor})
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('COUNT(', query['sql'])
+
+
+class TestTimeline(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.reader = User.objects.create_user(username='alice', password='alice123')
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.star = User.objects.create_user(username='luke', password='luke123')
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.star_client = Client()
+        self.star_client.force_login(self.star)
+
+    def follow(self, user):
+        self.client.get(reverse('profile_follow', kwargs={'username': user.username}))
+
+    def feed_texts(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_new_post_fans_out(self):
+        """Новый пост автора попадает в ленты его подписчиков."""
+        self.follow(self.author)
+        self.author_client.post(reverse('new_post'), data={'text': 'fan out'})
+        post = Post.objects.get(text='fan out')
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(self.feed_texts(), ['fan out'])
+
+    def test_follow_backfills_and_unfollow_drops(self):
+        """Подписка добавляет прошлые посты автора, отписка убирает их."""
+        Post.objects.create(text='old post', author=self.author)
+        self.follow(self.author)
+        self.assertEqual(self.feed_texts(), ['old post'])
+        self.client.get(
+            reverse('profile_unfollow', kwargs={'username': self.author.username})
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed_texts(), [])
+
+    def test_celebrity_posts_merged_at_read(self):
+        """Посты авторов-знаменитостей подмешиваются в ленту при чтении."""
+        self.follow(self.author)
+        self.follow(self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 1):
+            cache.clear()
+            for text in ('first', 'second', 'third'):
+                client = self.star_client if text == 'second' else self.author_client
+                client.post(reverse('new_post'), data={'text': text})
+            star_post = Post.objects.get(text='second')
+            self.assertFalse(
+                TimelineEntry.objects.filter(post=star_post).exists()
+            )
+            self.assertTrue(TimelineEntry.objects.filter(
+                user=self.reader, post__text='third'
+            ).exists())
+            self.assertEqual(self.feed_texts(), ['third', 'second', 'first'])
+
+
+@override_settings(FEED_ENGINE='pull')
+class TestPullFeed(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.reader = User.objects.create_user(username='alice', password='alice123')
+        self.authors = [
+            User.objects.create_user(username=f'author{i}', password='pass12345')
+            for i in range(3)
+        ]
+        for author in self.authors:
+            Follow.objects.create(user=self.reader, author=author)
+        for i in range(24):
+            Post.objects.create(text=f'pull {i}', author=self.authors[i % 3])
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def walk(self, engine):
+        paginator = feeds.follow_paginator(self.reader, engine=engine)
+        page = paginator.first_page()
+        ids = [post.id for post in page]
+        while page.has_next():
+            page = paginator.page_after(paginator.key(page.object_list[-1]))
+            ids += [post.id for post in page]
+        return ids
+
+    def test_pull_matches_join(self):
+        """Лента, собранная при чтении, совпадает с выборкой через JOIN."""
+        expected = self.walk('join')
+        self.assertEqual(len(expected), 24)
+        self.assertEqual(self.walk('pull'), expected)
+        # Страницы глубже кэшированных списков авторов дочитываются из базы.
+        with mock.patch.object(feeds, 'RECENT_POSTS_LIMIT', 3):
+            cache.clear()
+            self.assertEqual(self.walk('pull'), expected)
+
+    def test_pull_skips_fan_out(self):
+        """В режиме pull посты не раскладываются по лентам."""
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 10)
+
+    def test_new_post_invalidates_author_list(self):
+        self.client.get(reverse('follow_index'))
+        author_client = Client()
+        author_client.force_login(self.authors[0])
+        author_client.post(reverse('new_post'), data={'text': 'fresh pull post'})
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['page'][0].text, 'fresh pull post')
+
+
+class TestFeedQueryBudget(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.reader = User.objects.create_user(username='alice', password='alice123')
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.group = Group.objects.create(title='budget', slug='budget', description='-')
+
+    def add_posts(self, count):
+        for i in range(count):
+            author = User.objects.create_user(username=f'budget{Post.objects.count()}')
+            Follow.objects.create(user=self.reader, author=author)
+            post = Post.objects.create(text=f'budget {i}', author=author, group=self.group)
+            Comment.objects.create(post=post, author=self.reader, text='comment')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_queries_do_not_grow_with_page_size(self):
+        """Число запросов на страницу ленты не зависит от числа постов."""
+        urls = [
+            reverse('index'),
+            reverse('group_posts', kwargs={'slug': self.group.slug}),
+            reverse('follow_index'),
+        ]
+        self.add_posts(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_posts(8)
+        full = [self.count_queries(url) for url in urls]
+        self.assertEqual(small, full)
+        # Сессия, пользователь, страница ленты (+ подписки для ленты избранных).
+        for queries in full:
+            self.assertLessEqual(queries, 6)
+
+    def test_profile_queries_do_not_grow_with_page_size(self):
+        author = User.objects.create_user(username='rick', password='rick123')
+        url = reverse('profile', kwargs={'username': author.username})
+        Post.objects.create(text='one', author=author, group=self.group)
+        small = self.count_queries(url)
+        for i in range(9):
+            Post.objects.create(text=f'more {i}', author=author, group=self.group)
+        self.assertEqual(self.count_queries(url), small)
+
+
+class TestUserStats(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='alice123')
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def counters(self, user):
+        row = UserStats.objects.get(user=user)
+        return row.posts_count, row.followers_count, row.following_count
+
+    def test_counters_follow_changes(self):
+        """Счётчики меняются вместе с постами и подписками."""
+        self.client.get(reverse('profile_follow', kwargs={'username': 'rick'}))
+        Post.objects.create(text='first', author=self.author)
+        post = Post.objects.create(text='second', author=self.author)
+        self.assertEqual(self.counters(self.author), (2, 1, 0))
+        self.assertEqual(self.counters(self.user), (0, 0, 1))
+        post.delete()
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'rick'}))
+        self.assertEqual(self.counters(self.author), (1, 0, 0))
+        self.assertEqual(self.counters(self.user), (0, 0, 0))
+
+    def test_user_delete_keeps_counters(self):
+        """Удаление подписчика уменьшает счётчик подписчиков автора."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text='mine', author=self.user)
+        self.user.delete()
+        self.assertEqual(self.counters(self.author), (0, 0, 0))
+        self.assertFalse(UserStats.objects.filter(user_id=self.user.pk).exists())
+
+    def test_repair_fixes_drift(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        UserStats.objects.filter(user=self.author).update(followers_count=42)
+        UserStats.objects.filter(user=self.user).delete()
+        self.assertEqual(stats.repair(chunk_size=1), (1, 1))
+        self.assertEqual(self.counters(self.author), (0, 1, 0))
+        self.assertEqual(self.counters(self.user), (0, 0, 1))
+        self.assertEqual(stats.repair(), (0, 0))
+
+    def test_profile_counters(self):
+        """Профиль показывает счётчики за постоянное число запросов."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text='first', author=self.author)
+        url = reverse('profile', kwargs={'username': 'rick'})
+        # Валидатор ETag, сессия, пользователь, автор со счётчиками,
+        # страница, подписка.
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(response.context['count'], 1)
+        self.assertEqual(response.context['followers'], 1)
+        self.assertTrue(response.context['following'])
+
+
+class TestCommentCount(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='alice123')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(text='commented', author=self.user)
+
+    def comment_count(self):
+        return Post.objects.values_list('comment_count', flat=True).get(pk=self.post.pk)
+
+    def test_add_and_delete_comment(self):
+        """Счётчик комментариев меняется при добавлении и удалении."""
+        url = reverse('add_comment', kwargs={'username': 'alice', 'post_id': self.post.pk})
+        self.client.post(url, data={'text': 'one'})
+        self.client.post(url, data={'text': 'two'})
+        self.assertEqual(self.comment_count(), 2)
+        # Удаление из админки идёт через QuerySet.delete().
+        Comment.objects.filter(text='one').delete()
+        self.assertEqual(self.comment_count(), 1)
+        response = self.client.get(reverse('profile', kwargs={'username': 'alice'}))
+        self.assertContains(response, '1 комментариев')
+
+    def test_reconcile(self):
+        Comment.objects.create(post=self.post, author=self.user, text='one')
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+        self.assertEqual(stats.repair_comment_counts(), 1)
+        self.assertEqual(self.comment_count(), 1)
+        self.assertEqual(stats.repair_comment_counts(), 0)
+
+
+class TestQueryPlans(TestCase):
+    """Запросы страниц не должны сканировать таблицы целиком и сортировать
+    результат во временном B-дереве (EXPLAIN QUERY PLAN в SQLite)."""
+
+    FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='alice123')
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.group = Group.objects.create(title='plans', slug='plans', description='-')
+        Follow.objects.create(user=self.user, author=self.author)
+        for i in range(15):
+            post = Post.objects.create(text=f'plan {i}', author=self.author, group=self.group)
+            Comment.objects.create(post=post, author=self.user, text='comment')
+        self.post = post
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def plan_problems(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[3] for row in cursor.fetchall()]
+        return [
+            detail for detail in details
+            if self.FULL_SCAN.match(detail) or 'TEMP B-TREE' in detail
+        ]
+
+    def assert_indexed(self, url, params=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            self.assertEqual(self.plan_problems(sql), [], msg=f'{url}: {sql}')
+        return response
+
+    def test_feed_plans(self):
+        for url in (
+            reverse('index'),
+            reverse('group_posts', kwargs={'slug': 'plans'}),
+            reverse('profile', kwargs={'username': 'rick'}),
+            reverse('follow_index'),
+        ):
+            with self.subTest(url=url):
+                response = self.assert_indexed(url)
+                page = response.context['page']
+                self.assert_indexed(url, {'cursor': page.next_cursor})
+                self.assert_indexed(url, {'page': 2})
+
+    @override_settings(FEED_ENGINE='pull')
+    def test_pull_feed_plan(self):
+        self.assert_indexed(reverse('follow_index'))
+
+    def test_post_page_plan(self):
+        self.assert_indexed(
+            reverse('post', kwargs={'username': 'rick', 'post_id': self.post.pk})
+        )
+
+
+class TestFeedPageCache(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        Post.objects.create(text='cached post', author=self.author)
+
+    def test_hit_without_queries(self):
+        """Пока контент не менялся, главная отдаётся из кэша без запросов."""
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'cached post')
+
+    def test_comment_invalidates_page(self):
+        self.client.get(reverse('index'))
+        Comment.objects.create(
+            post=Post.objects.get(text='cached post'), author=self.author, text='hi'
+        )
+        self.assertContains(self.client.get(reverse('index')), '1 комментариев')
+
+    def test_stale_while_revalidate(self):
+        """Пока страницу пересобирает другой запрос, отдаётся прежняя версия."""
+        self.client.get(reverse('index'))
+        Post.objects.create(text='fresh post', author=self.author)
+        request = RequestFactory().get(reverse('index'))
+        request.user = AnonymousUser()
+        lock_key = caching.page_key('index_page', request) + ':lock'
+        cache.add(lock_key, 1)
+        self.assertNotContains(self.client.get(reverse('index')), 'fresh post')
+        cache.delete(lock_key)
+        self.assertContains(self.client.get(reverse('index')), 'fresh post')
+
+    @override_settings(FEED_CACHE_STALE_WHILE_REVALIDATE=False)
+    def test_without_stale_while_revalidate(self):
+        self.client.get(reverse('index'))
+        Post.objects.create(text='fresh post', author=self.author)
+        self.assertContains(self.client.get(reverse('index')), 'fresh post')
+
+
+class TestPostCardCache(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.reader = User.objects.create_user(username='alice', password='alice123')
+        self.group = Group.objects.create(title='cards', slug='cards', description='-')
+        self.post = Post.objects.create(text='card text', author=self.author, group=self.group)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_card_shared_between_pages(self):
+        """Карточка отрисовывается один раз и переиспользуется всеми лентами."""
+        hits_before, misses_before, _ = post_cards.card_counter.totals()
+        with mock.patch.object(
+            post_cards, 'render_to_string', wraps=post_cards.render_to_string
+        ) as render:
+            for url in (
+                reverse('index'),
+                reverse('group_posts', kwargs={'slug': 'cards'}),
+                reverse('profile', kwargs={'username': 'rick'}),
+            ):
+                self.assertContains(self.reader_client.get(url), 'card text')
+        cards = [c for c in render.call_args_list if c[0][0] == 'includes/post_card.html']
+        self.assertEqual(len(cards), 1)
+        hits, misses, _ = post_cards.card_counter.totals()
+        self.assertEqual(hits - hits_before, 2)
+        self.assertEqual(misses - misses_before, 1)
+
+    def test_repeated_save_bumps_version(self):
+        url = reverse('group_posts', kwargs={'slug': 'cards'})
+        self.reader_client.get(url)
+        for text in ('first edit', 'second edit'):
+            self.post.text = text
+            self.post.save()
+            self.assertContains(self.reader_client.get(url), text)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).version, self.post.version)
+
+    def test_page_cards_fetched_in_one_call(self):
+        """Карточки страницы достаются из кэша одним get_many."""
+        for i in range(4):
+            Post.objects.create(text=f'more {i}', author=self.author, group=self.group)
+        url = reverse('group_posts', kwargs={'slug': 'cards'})
+        self.reader_client.get(url)
+        backend = caches['default']
+        hits_before, _, _ = post_cards.card_counter.totals()
+        with mock.patch.object(backend, 'get', wraps=backend.get) as get, \
+                mock.patch.object(backend, 'get_many', wraps=backend.get_many) as get_many:
+            self.assertContains(self.reader_client.get(url), 'card text')
+        card_gets = [c for c in get.call_args_list if str(c[0][0]).startswith('post_card:')]
+        self.assertEqual(card_gets, [])
+        card_batches = [
+            c for c in get_many.call_args_list
+            if any(str(k).startswith('post_card:') for k in c[0][0])
+        ]
+        self.assertEqual(len(card_batches), 1)
+        self.assertEqual(len(card_batches[0][0][0]), 5)
+        hits, _, _ = post_cards.card_counter.totals()
+        self.assertEqual(hits - hits_before, 5)
+
+    def test_edit_link_only_for_author(self):
+        url = reverse('profile', kwargs={'username': 'rick'})
+        self.assertNotContains(self.reader_client.get(url), 'Редактировать')
+        self.assertContains(self.author_client.get(url), 'Редактировать', count=1)
+        self.assertNotContains(self.reader_client.get(url), 'Редактировать')
+
+    def test_edit_and_comment_refresh_card(self):
+        """Правка поста и новый комментарий меняют версию карточки."""
+        url = reverse('profile', kwargs={'username': 'rick'})
+        self.reader_client.get(url)
+        self.author_client.post(
+            reverse('post_edit', kwargs={'username': 'rick', 'post_id': self.post.pk}),
+            data={'text': 'edited card', 'group': self.group.pk},
+        )
+        self.assertContains(self.reader_client.get(url), 'edited card')
+        self.reader_client.post(
+            reverse('add_comment', kwargs={'username': 'rick', 'post_id': self.post.pk}),
+            data={'text': 'nice'},
+        )
+        self.assertContains(self.reader_client.get(url), '1 комментариев')
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.reader = User.objects.create_user(username='morty', password='morty123')
+        self.group = Group.objects.create(title='Citadel', slug='citadel')
+        self.post = Post.objects.create(
+            text='conditional post', author=self.author, group=self.group
+        )
+        self.urls = (
+            reverse('group_posts', kwargs={'slug': 'citadel'}),
+            reverse('profile', kwargs={'username': 'rick'}),
+            reverse('post', kwargs={'username': 'rick', 'post_id': self.post.pk}),
+        )
+
+    def assertNotModified(self, url, expected=True):
+        etag = self.client.get(url)['ETag']
+        status = 304 if expected else 200
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status, url)
+        return response
+
+    def test_not_modified(self):
+        for url in self.urls:
+            self.assertNotModified(url)
+
+    def test_comment_changes_etag(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            Comment.objects.create(post=self.post, author=self.author, text='hi')
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_viewer_changes_etag(self):
+        """Гость и вошедший пользователь получают разные валидаторы."""
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            self.client.force_login(self.reader)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.client.logout()
+
+    def test_follow_changes_profile_etag(self):
+        self.client.force_login(self.reader)
+        url = reverse('profile', kwargs={'username': 'rick'})
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validator_does_not_render(self):
+        url = reverse('post', kwargs={'username': 'rick', 'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_profile(self):
+        url = reverse('profile', kwargs={'username': 'nobody'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_if_modified_since(self):
+        # Последнее изменение было раньше текущей секунды.
+        cache.set(caching.CHANGED_AT_KEY, time.time() - 10, None)
+        for url in self.urls:
+            since = self.client.get(url)['Last-Modified']
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+            self.assertEqual(response.status_code, 304, url)
+        since = self.client.get(self.urls[1])['Last-Modified']
+        Follow.objects.create(user=self.reader, author=self.author)
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_no_last_modified_for_members(self):
+        cache.set(caching.CHANGED_AT_KEY, time.time() - 10, None)
+        self.client.force_login(self.reader)
+        for url in self.urls:
+            self.assertFalse(self.client.get(url).has_header('Last-Modified'), url)
+
+
+def _incr_in_child(path, times):
+    backend = SQLiteCache(path, {})
+    for _ in range(times):
+        backend.incr('counter')
+
+
+class TestSQLiteCache(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite3')
+        self.backend = self.make_backend()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def make_backend(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_add_and_ttl(self):
+        self.assertTrue(self.backend.add('key', 'value', 1))
+        self.assertFalse(self.backend.add('key', 'other', 1))
+        self.assertEqual(self.make_backend().get('key'), 'value')
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertIsNone(self.backend.get('key'))
+            self.assertTrue(self.backend.add('key', 'other', 1))
+
+    def test_incr_across_processes(self):
+        """incr атомарен между процессами, работающими с одним файлом."""
+        self.backend.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_incr_in_child, args=(self.path, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.backend.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.backend.incr('missing')
+
+    def test_lru_eviction_by_bytes(self):
+        backend = self.make_backend(MAX_BYTES=10000, TOUCH_INTERVAL=0)
+        for i in range(5):
+            backend.set(f'key{i}', 'x' * 1500)
+        backend.get('key0')
+        for i in range(5, 10):
+            backend.set(f'key{i}', 'x' * 1500)
+        self.assertIsNotNone(backend.get('key0'))
+        self.assertIsNone(backend.get('key1'))
+        self.assertIsNotNone(backend.get('key9'))
+
+    def test_get_many(self):
+        self.backend.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.backend.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+
+    def test_get_many_counts_as_access(self):
+        backend = self.make_backend(MAX_BYTES=10000, TOUCH_INTERVAL=0)
+        for i in range(5):
+            backend.set(f'key{i}', 'x' * 1500)
+        backend.get_many(['key0'])
+        for i in range(5, 10):
+            backend.set(f'key{i}', 'x' * 1500)
+        self.assertEqual(list(backend.get_many(['key0', 'key1'])), ['key0'])
+
+    def test_get_or_set_single_flight(self):
+        """Отсутствующее значение вычисляет только один поток."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'fresh'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    self.make_backend().get_or_set('hot', compute)
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['fresh'] * 4)
+
+
+class TestTwoLevelCache(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.first = self.make_process()
+        self.second = self.make_process()
+
+    def make_process(self, check_interval=0):
+        """Кэш с собственным L1, как в отдельном воркере."""
+        backend = TwoLevelCache('shared', {
+            'OPTIONS': {'CHECK_INTERVAL': check_interval},
+        })
+        backend._store = LocalLRU(100, 1024 * 1024)
+        return backend
+
+    def test_hit_from_local_store(self):
+        self.first.set('key', {'value': 1})
+        self.assertEqual(self.first.get('key'), {'value': 1})
+        shared = caches['shared']
+        with mock.patch.object(shared, 'get', wraps=shared.get) as get, \
+                mock.patch.object(shared, 'get_many', wraps=shared.get_many) as get_many:
+            self.assertEqual(self.first.get('key'), {'value': 1})
+        # Сверка версии читает служебные ключи, сам ключ из общего кэша не читается.
+        self.assertNotIn('key', [c[0][0] for c in get.call_args_list])
+        self.assertFalse([c for c in get_many.call_args_list if 'key' in c[0][0]])
+
+    def test_mutable_values_are_copies(self):
+        self.first.set('key', {'value': 1})
+        self.first.get('key')['value'] = 2
+        self.assertEqual(self.first.get('key'), {'value': 1})
+
+    def test_write_reaches_other_process(self):
+        self.first.set('key', 1)
+        self.assertEqual(self.second.get('key'), 1)
+        self.first.set('key', 2)
+        self.assertEqual(self.second.get('key'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_staleness_is_bounded(self):
+        """Чужая запись видна не позже чем через CHECK_INTERVAL."""
+        second = self.make_process(check_interval=1)
+        self.first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        self.first.incr('key')
+        self.assertEqual(second.get('key'), 1)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 2):
+            self.assertEqual(second.get('key'), 2)
+
+    def test_clear_reaches_other_process(self):
+        self.first.set('key', 1)
+        self.second.get('key')
+        self.first.clear()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_local_store_bounds(self):
+        store = LocalLRU(max_entries=3, max_bytes=1600)
+        for i in range(4):
+            store.put(i, i, 30, store.seq)
+        self.assertEqual(len(store), 3)
+        store.put('big', 'x' * 1500, 30, store.seq)
+        self.assertEqual(store.get('big'), 'x' * 1500)
+        self.assertEqual(store.get(3), 3)
+        self.assertEqual(len(store), 2)
+
+
+class TestThumbnails(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(self.media.cleanup)
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        image = io.BytesIO()
+        Image.new('RGB', (500, 500), color=(255, 0, 0)).save(image, format='jpeg')
+        self.post = Post.objects.create(
+            text='thumbnail post', author=self.author,
+            image=ContentFile(image.getvalue(), name='thumb.jpg'),
+        )
+
+    def test_placeholder_until_ready(self):
+        """Шаблон не нарезает картинку сам, а ставит её в очередь."""
+        # В TestCase транзакция не фиксируется - выполняем on_commit сразу.
+        with mock.patch('django.db.transaction.on_commit', lambda func: func()), \
+                mock.patch.object(thumbnails, 'enqueue') as enqueue:
+            response = self.client.get(reverse('index'))
+        enqueue.assert_called_once_with(self.post.pk)
+        placeholder = f'src="{self.post.image_placeholder}"'
+        self.assertContains(response, placeholder)
+
+        self.assertTrue(thumbnails.generate(self.post.pk))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, thumbnails.image_sources(self.post)['src'])
+        self.assertNotContains(response, placeholder)
+
+    @override_settings(POST_IMAGE_VARIANTS={'widths': [320, 960]})
+    def test_variants(self):
+        thumbnails.generate(self.post.pk)
+        self.post.refresh_from_db()
+        sources = thumbnails.image_sources(self.post)
+        self.assertEqual(sources['width'], 960)
+        self.assertEqual(sources['height'], 339)
+        self.assertRegex(sources['srcset'], r'^\S+\.jpg 320w, \S+\.jpg 960w$')
+        self.assertRegex(
+            sources['sources'][0]['srcset'], r'^\S+\.webp 320w, \S+\.webp 960w$'
+        )
+        with Image.open(os.path.join(
+            self.media.name, json.loads(self.post.image_variants)['variants'][0]['name']
+        )) as small:
+            self.assertEqual((small.format, small.size), ('WEBP', (320, 113)))
+
+    def test_manifest_outdated(self):
+        """Смена набора вариантов или картинки делает манифест устаревшим."""
+        thumbnails.generate(self.post.pk)
+        self.post.refresh_from_db()
+        self.assertIsNotNone(thumbnails.manifest(self.post))
+        with override_settings(POST_IMAGE_VARIANTS={'widths': [640]}):
+            self.assertIsNone(thumbnails.manifest(self.post))
+            self.assertEqual(thumbnails.backfill(), (1, 0))
+            self.post.refresh_from_db()
+            self.assertIsNotNone(thumbnails.manifest(self.post))
+        self.post.image = 'posts/other.jpg'
+        self.assertIsNone(thumbnails.manifest(self.post))
+
+    def test_generate_is_idempotent(self):
+        thumbnails.generate(self.post.pk)
+        self.assertTrue(thumbnails.generate(self.post.pk))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+
+    def test_missing_source(self):
+        Post.objects.filter(pk=self.post.pk).update(image='posts/missing.jpg')
+        self.assertFalse(thumbnails.generate(self.post.pk))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 1)
+
+    def test_metadata_on_save(self):
+        self.assertEqual((self.post.image_width, self.post.image_height), (500, 500))
+        self.assertTrue(self.post.image_placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(self.post.image_placeholder), 1000)
+        self.post.image = None
+        self.post.save()
+        self.assertIsNone(self.post.image_width)
+        self.assertEqual(self.post.image_placeholder, '')
+
+    def test_metadata_rotated_by_exif(self):
+        image = Image.new('RGB', (400, 200), color=(0, 0, 255))
+        exif = image.getexif()
+        exif[thumbnails.EXIF_ORIENTATION] = 6
+        content = io.BytesIO()
+        image.save(content, format='jpeg', exif=exif)
+        width, height, _ = thumbnails.describe(content)
+        self.assertEqual((width, height), (200, 400))
+
+    def test_generate_fills_missing_metadata(self):
+        """Пост, сохранённый без формы, получает размеры от воркера."""
+        Post.objects.filter(pk=self.post.pk).update(
+            image_width=None, image_height=None, image_placeholder=''
+        )
+        thumbnails.generate(self.post.pk)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.image_width, 500)
+        self.assertTrue(self.post.image_placeholder)
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_enqueue_once(self):
+        with mock.patch.object(thumbnails, 'generate', return_value=False) as generate:
+            thumbnails.enqueue(self.post.pk)
+            thumbnails.enqueue(self.post.pk)
+        generate.assert_called_once_with(self.post.pk)
+
+
+class TestImageUpload(TestCase):
+    def upload(self, image, fmt='jpeg', name='photo.jpg', **save_kwargs):
+        content = io.BytesIO()
+        image.save(content, format=fmt, **save_kwargs)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def clean(self, upload):
+        form = PostForm(data={'text': 'upload'}, files={'image': upload})
+        form.is_valid()
+        return form
+
+    def test_downscaled_progressive_without_exif(self):
+        image = Image.new('RGB', (4096, 1024), color=(0, 128, 0))
+        exif = image.getexif()
+        exif[0x010e] = 'x' * 10000  # ImageDescription
+        form = self.clean(self.upload(image, exif=exif))
+        self.assertTrue(form.is_valid(), form.errors)
+        with Image.open(form.cleaned_data['image']) as result:
+            self.assertEqual(result.format, 'JPEG')
+            self.assertEqual(result.size, (2048, 512))
+            self.assertTrue(result.info.get('progressive'))
+            self.assertNotIn('exif', result.info)
+
+    def test_transparent_png_kept(self):
+        image = Image.new('RGBA', (300, 200), color=(255, 0, 0, 0))
+        form = self.clean(self.upload(image, fmt='png', name='logo.png'))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['image'].name, 'logo.png')
+        with Image.open(form.cleaned_data['image']) as result:
+            self.assertEqual((result.format, result.mode), ('PNG', 'RGBA'))
+
+    def test_pixel_cap(self):
+        """Слишком большая по пикселям картинка отклоняется до декодирования."""
+        upload = self.upload(Image.new('RGB', (200, 200)))
+        with mock.patch.object(uploads, 'MAX_PIXELS', 100 * 100), \
+                mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            form = self.clean(upload)
+        self.assertIn('мегапикселей', form.errors['image'][0])
+        load.assert_not_called()
+
+    def test_size_cap(self):
+        with mock.patch.object(uploads, 'MAX_UPLOAD_SIZE', 10):
+            form = self.clean(self.upload(Image.new('RGB', (20, 20))))
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+
+class TestContentAddressedMedia(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(self.media.cleanup)
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        content = io.BytesIO()
+        Image.new('RGB', (64, 64), color=(0, 0, 255)).save(content, format='jpeg')
+        self.content = content.getvalue()
+
+    def create_post(self, name='meme.jpg', content=None):
+        return Post.objects.create(
+            text='meme', author=self.author,
+            image=ContentFile(content or self.content, name=name),
+        )
+
+    def blob_files(self):
+        storage = Post._meta.get_field('image').storage
+        return [name for name, _, _ in storage.iter_files('posts')]
+
+    def test_same_bytes_stored_once(self):
+        first = self.create_post('meme.jpg')
+        second = self.create_post('copy.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/\w\w/\w\w/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(self.blob_files(), [first.image.name])
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).refcount, 2)
+
+    def test_references_follow_posts(self):
+        first = self.create_post()
+        second = self.create_post()
+        name = first.image.name
+        first.delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).refcount, 1)
+        second.image = None
+        second.save()
+        self.assertEqual(ImageBlob.objects.get(name=name).refcount, 0)
+
+    def test_garbage_collection(self):
+        kept = self.create_post()
+        dropped = self.create_post(content=self.content + b'\0')
+        thumbnails.generate(dropped.pk)
+        dropped.refresh_from_db()
+        variants = [
+            variant['name'] for variant in
+            json.loads(dropped.image_variants)['variants']
+        ]
+        dropped.delete()
+        storage = Post._meta.get_field('image').storage
+        self.assertEqual(media.collect_garbage(), (0, 0))
+        self.assertEqual(media.collect_garbage(grace=0, dry_run=True)[0], 1)
+        self.assertTrue(storage.exists(dropped.image.name))
+        self.assertTrue(all(map(storage.exists, variants)))
+
+        deleted, freed = media.collect_garbage(grace=0)
+        self.assertEqual((deleted, freed), (1, len(self.content) + 1))
+        self.assertEqual(self.blob_files(), [kept.image.name])
+        self.assertFalse(ImageBlob.objects.filter(name=dropped.image.name).exists())
+        # Миниатюры удалённого файла удаляются вместе с ним.
+        self.assertFalse(any(map(storage.exists, variants)))
+
+    def test_drifted_counter_is_repaired(self):
+        post = self.create_post()
+        Post.objects.filter(pk=post.pk).update(image='')
+        self.assertEqual(media.collect_garbage(grace=0), (0, 0))
+        self.assertEqual(ImageBlob.objects.get(name=post.image.name).refcount, 0)
+        self.assertEqual(media.collect_garbage(grace=0)[0], 1)
+
+
+class TestSearch(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='rick', password='rick123')
+        self.client = Client()
+
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params})
+
+    def test_ranked_results(self):
+        once = Post.objects.create(text='про кота и собаку', author=self.author)
+        often = Post.objects.create(text='кота кота кота', author=self.author)
+        Post.objects.create(text='только собака', author=self.author)
+        response = self.search('кота')
+        self.assertEqual(list(response.context['page']), [often, once])
+        # Последнее слово ищется как префикс.
+        self.assertEqual(len(self.search('соба').context['page']), 2)
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(text='старый текст', author=self.author)
+        post.text = 'новый текст'
+        post.save()
+        self.assertEqual(len(self.search('старый').context['page']), 0)
+        self.assertEqual(list(self.search('новый').context['page']), [post])
+        Post.objects.filter(pk=post.pk).update(comment_count=5)
+        self.assertEqual(list(self.search('новый').context['page']), [post])
+        post.delete()
+        self.assertEqual(len(self.search('новый').context['page']), 0)
+
+    def test_cursor_pagination(self):
+        for i in range(25):
+            Post.objects.create(text='слово ' * (i % 5 + 1), author=self.author)
+        seen, params = [], {}
+        while True:
+            page = self.search('слово', **params).context['page']
+            seen.extend(post.search_rank for post in page)
+            if not page.has_next():
+                break
+            params = {'cursor': page.next_cursor}
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen))
+        back = self.search('слово', cursor=page.previous_cursor).context['page']
+        self.assertEqual([post.search_rank for post in back], seen[10:20])
+
+    def test_page_is_two_queries(self):
+        for i in range(15):
+            Post.objects.create(text=f'запрос {i}', author=self.author)
+        paginator = search.SearchPaginator(
+            Post.objects.for_feed(), search.build_query('запрос')
+        )
+        with self.assertNumQueries(2):
+            page = paginator.first_page()
+            [post.author.username for post in page]
+        self.assertEqual(len(page), 10)
+
+    def test_query_syntax_is_escaped(self):
+        Post.objects.create(text='обычный текст', author=self.author)
+        self.assertEqual(search.build_query('"текст" OR (NEAR'), '"текст" "or" "near"*')
+        for query in ('"', 'AND (', '***', ''):
+            self.assertEqual(self.search(query).status_code, 200)
+
+    def test_install_repairs_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER posts_post_fts_insert')
+        post = Post.objects.create(text='потерянный пост', author=self.author)
+        self.assertEqual(len(self.search('потерянный').context['page']), 0)
+        search.install(connection)
+        self.assertEqual(list(self.search('потерянный').context['page']), [post])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin123')
+        post = Post.objects.create(text='найди меня', author=self.author)
+        Comment.objects.create(post=post, author=self.author, text='комментарий к посту')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'найди'}
+            )
+        self.assertEqual(list(response.context['cl'].result_list), [post])
+        self.assertTrue(any('MATCH' in q['sql'] for q in queries.captured_queries))
+        self.assertFalse(any('LIKE' in q['sql'] for q in queries.captured_queries))
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'комментарий'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@mock.patch('django.db.transaction.on_commit', lambda func: func())
+class TestAutocomplete(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        for catalog in autocomplete.CATALOGS.values():
+            catalog._index = None
+        for name in ('alice', 'Alex', 'bob'):
+            User.objects.create_user(username=name, password='pass12345')
+        Group.objects.create(title='Кошки и коты', slug='cats', description='-')
+        Group.objects.create(title='Собаки', slug='dogs', description='-')
+        self.client = Client()
+
+    def suggest(self, kind, query):
+        response = self.client.get(reverse('autocomplete', kwargs={'kind': kind}), {'q': query})
+        return [item['text'] for item in response.json()['results']]
+
+    def test_prefix_matches(self):
+        self.assertEqual(self.suggest('users', 'AL'), ['Alex', 'alice'])
+        self.assertEqual(self.suggest('users', 'z'), [])
+        self.assertEqual(self.suggest('groups', 'кот'), ['Кошки и коты'])
+        self.assertEqual(self.suggest('groups', 'do'), ['Собаки'])
+        self.assertEqual(self.suggest('groups', ''), [])
+        response = self.client.get(reverse('autocomplete', kwargs={'kind': 'posts'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_updated_incrementally(self):
+        self.suggest('users', 'a')
+        with self.assertNumQueries(0):
+            autocomplete.users.search('a')
+        User.objects.create_user(username='alfred', password='pass12345')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(autocomplete.users.search('al')), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"auth_user"."id" >', queries[0]['sql'])
+
+    def test_rename_and_delete_rebuild_index(self):
+        self.assertEqual(self.suggest('groups', 'соб'), ['Собаки'])
+        group = Group.objects.get(slug='dogs')
+        group.title = 'Псы'
+        group.save()
+        self.assertEqual(self.suggest('groups', 'соб'), [])
+        self.assertEqual(self.suggest('groups', 'пс'), ['Псы'])
+        User.objects.get(username='bob').delete()
+        self.assertEqual(self.suggest('users', 'b'), [])
+
+    def test_login_keeps_index(self):
+        self.suggest('users', 'a')
+        self.client.login(username='alice', password='pass12345')
+        with self.assertNumQueries(0):
+            autocomplete.users.search('a')
+
+    def test_form_renders_only_selected_group(self):
+        user = User.objects.get(username='alice')
+        self.client.force_login(user)
+        for i in range(20):
+            Group.objects.create(title=f'group {i}', slug=f'group-{i}', description='-')
+        response = self.client.get(reverse('new_post'))
+        self.assertEqual(response.content.decode().count('<option'), 1)
+        self.assertContains(response, 'data-autocomplete="/autocomplete/groups/"')
+        group = Group.objects.get(slug='cats')
+        post = Post.objects.create(text='текст', author=user, group=group)
+        response = self.client.get(
+            reverse('post_edit', kwargs={'username': 'alice', 'post_id': post.pk})
+        )
+        self.assertContains(response, '<option', count=2)
+        self.assertContains(response, f'<option value="{group.pk}" selected>')
+
+
+class TestAdminChangelist(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin123')
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def create_posts(self, count):
+        start = User.objects.count()
+        authors = [
+            User.objects.create_user(username=f'author{start + i}', password='pass12345')
+            for i in range(count)
+        ]
+        posts = [Post.objects.create(text=f'пост {i}', author=a) for i, a in enumerate(authors)]
+        for post in posts:
+            Comment.objects.create(post=post, author=post.author, text='комментарий')
+        return posts
+
+    def changelist(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse(f'admin:posts_{model}_changelist'), params
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in queries.captured_queries]
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.create_posts(3)
+        counts = {model: len(self.changelist(model)[1]) for model in ('post', 'comment')}
+        self.create_posts(10)
+        for model, count in counts.items():
+            self.assertEqual(len(self.changelist(model)[1]), count, model)
+
+    def test_no_full_count_or_distinct_dates(self):
+        posts = self.create_posts(5)
+        response, queries = self.changelist('post')
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql or 'DISTINCT' in sql])
+        # Оценка по диапазону id: удалённые строки её не уменьшают.
+        posts[2].delete()
+        self.assertEqual(self.changelist('post')[0].context['cl'].result_count, 5)
+
+    def test_filtered_count_is_cached(self):
+        self.create_posts(3)
+        response, queries = self.changelist('post', q='пост')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertTrue([sql for sql in queries if 'COUNT(' in sql])
+        response, queries = self.changelist('post', q='пост')
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql])
+
+    def test_date_hierarchy(self):
+        old, new = self.create_posts(2)
+        Post.objects.filter(pk=old.pk).update(pub_date=datetime(2019, 3, 5, 12, tzinfo=timezone.utc))
+        Post.objects.filter(pk=new.pk).update(pub_date=datetime(2021, 7, 9, 12, tzinfo=timezone.utc))
+        response, queries = self.changelist('post')
+        self.assertContains(response, 'pub_date__year=2019')
+        self.assertContains(response, 'pub_date__year=2021')
+        self.assertNotContains(response, 'pub_date__year=2020')
+        self.assertFalse([sql for sql in queries if 'DISTINCT' in sql])
+        response, _ = self.changelist('post', pub_date__year=2021)
+        self.assertContains(response, 'pub_date__month=7')
+        self.assertEqual(list(response.context['cl'].result_list), [new])
+        response, _ = self.changelist('post', pub_date__year=2021, pub_date__month=7)
+        self.assertContains(response, 'pub_date__day=9')
+
+
+@mock.patch('django.db.transaction.on_commit', lambda func: func())
+class TestModeration(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.spammer = User.objects.create_user(username='spammer', password='spam12345')
+        self.reader = User.objects.create_user(username='reader', password='read12345')
+        Follow.objects.create(user=self.reader, author=self.spammer)
+        Follow.objects.create(user=self.spammer, author=self.reader)
+        self.own = Post.objects.create(text='обычный пост', author=self.reader)
+        for i in range(7):
+            post = Post.objects.create(text=f'спам {i}', author=self.spammer)
+            Comment.objects.create(post=post, author=self.reader, text='ответ')
+            Comment.objects.create(post=self.own, author=self.spammer, text='спам')
+
+    def test_delete_posts_in_batches(self):
+        done = []
+        with CaptureQueriesContext(connection) as queries:
+            deleted = moderation.delete_posts(
+                Post.objects.filter(author=self.spammer), batch_size=3,
+                progress=lambda label, count: done.append((label, count)),
+            )
+        self.assertEqual(deleted['posts.Post'], 7)
+        self.assertEqual(deleted['posts.Comment'], 7)
+        self.assertIn(('posts.Post', 3), done)
+        self.assertIn(('posts.Post', 7), done)
+        post_deletes = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('DELETE FROM "posts_post"')
+        ]
+        self.assertEqual(len(post_deletes), 3)
+        self.assertEqual(stats.get_stats(User.objects.get(pk=self.spammer.pk)).posts_count, 0)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_delete_users_keeps_counters(self):
+        deleted = moderation.delete_users(User.objects.filter(pk=self.spammer.pk), batch_size=4)
+        self.assertEqual(deleted['auth.User'], 1)
+        self.assertFalse(User.objects.filter(username='spammer').exists())
+        self.own.refresh_from_db()
+        self.assertEqual(self.own.comment_count, 0)
+        reader_stats = UserStats.objects.get(user=self.reader)
+        self.assertEqual((reader_stats.followers_count, reader_stats.following_count), (0, 0))
+        self.assertEqual(list(Post.objects.all()), [self.own])
+
+    def test_deactivate_hides_from_autocomplete(self):
+        autocomplete.users._index = None
+        self.assertEqual(len(autocomplete.users.search('spam')), 1)
+        self.assertEqual(moderation.deactivate_users(User.objects.filter(username='spammer')), 1)
+        self.assertEqual(autocomplete.users.search('spam'), [])
+        self.assertFalse(self.client.login(username='spammer', password='spam12345'))
+
+    def test_admin_action_and_command(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin123')
+        self.client.force_login(admin)
+        url = reverse('admin:posts_comment_changelist')
+        choices = self.client.get(url).context['action_form'].fields['action'].choices
+        self.assertNotIn('delete_selected', dict(choices))
+        ids = Comment.objects.filter(author=self.spammer).values_list('pk', flat=True)
+        response = self.client.post(url, {
+            'action': 'delete_comments', '_selected_action': list(ids),
+        }, follow=True)
+        self.assertContains(response, 'posts.Comment: 7')
+        self.own.refresh_from_db()
+        self.assertEqual(self.own.comment_count, 0)
+        out = io.StringIO()
+        call_command('moderate', 'spammer', '--what', 'posts', '--deactivate', stdout=out)
+        self.assertIn('posts.Post: 7', out.getvalue())
+        self.assertFalse(User.objects.get(username='spammer').is_active)
+
+
+class TestImportContent(TestCase):
+    RECORDS = [
+        {'type': 'follow', 'user': 'ann', 'author': 'leo'},
+        {'type': 'post', 'id': 'p1', 'author': 'leo', 'group': 'cats',
+         'text': 'импортированный котик', 'pub_date': '2019-05-01T10:00:00Z'},
+        {'type': 'post', 'id': 'p2', 'author': 'leo', 'text': 'второй'},
+        {'type': 'comment', 'id': 'c1', 'post': 'p1', 'author': 'ann',
+         'text': 'мяу', 'created': '2019-05-02T10:00:00Z'},
+        {'type': 'comment', 'id': 'c2', 'post': 'p9', 'author': 'ann', 'text': '?'},
+        {'type': 'post', 'id': 'p3', 'author': 'nobody', 'text': 'чужой'},
+        {'type': 'unknown'},
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.leo = User.objects.create_user(username='leo', password='12345')
+        self.ann = User.objects.create_user(username='ann', password='12345')
+        self.group = Group.objects.create(title='Коты', slug='cats')
+        self.tmp = tempfile.mkdtemp()
+
+    def write(self, name, lines):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as fileobj:
+            fileobj.write(''.join(lines))
+        return path
+
+    def write_jsonl(self, records):
+        return self.write('dump.jsonl', [json.dumps(r) + '\n' for r in records])
+
+    @mock.patch('django.db.transaction.on_commit', lambda func: func())
+    def test_import_and_rerun(self):
+        result = importer.Importer().run(iter(self.RECORDS))
+        self.assertEqual(
+            (result['posts'], result['comments'], result['follows'], result['invalid']),
+            (2, 1, 1, 3),
+        )
+        post = Post.objects.get(text='импортированный котик')
+        self.assertEqual(post.pub_date, datetime(2019, 5, 1, 10, tzinfo=timezone.utc))
+        self.assertEqual((post.group, post.comment_count), (self.group, 1))
+        self.assertEqual(Comment.objects.get().post, post)
+        leo_stats = UserStats.objects.get(user=self.leo)
+        self.assertEqual((leo_stats.posts_count, leo_stats.followers_count), (2, 1))
+        self.assertEqual(UserStats.objects.get(user=self.ann).following_count, 1)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.ann).count(), 2)
+        self.assertEqual(list(search.matching(Post.objects.all(), 'котик')), [post])
+
+        again = importer.Importer().run(iter(self.RECORDS))
+        self.assertEqual(
+            (again['posts'], again['post_duplicates'], again['comment_duplicates'],
+             again['follow_duplicates']),
+            (0, 2, 1, 1),
+        )
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(UserStats.objects.get(user=self.leo).posts_count, 2)
+
+    def test_deleted_ids_not_reused(self):
+        post = {'type': 'post', 'author': 'leo', 'text': 'первый'}
+        importer.Importer().run(iter([dict(post, id='p1')]))
+        moderation.delete_posts(Post.objects.filter(text='первый'))
+        again = importer.Importer().run(iter([dict(post, id='p1')]))
+        self.assertEqual((again['posts'], again['post_duplicates']), (0, 1))
+        self.assertFalse(Post.objects.filter(text='первый').exists())
+        Post.objects.create(text='с сайта', author=self.leo)
+        result = importer.Importer().run(iter([
+            dict(post, id='p2', text='второй'),
+            {'type': 'comment', 'id': 'c1', 'post': 'p1', 'author': 'ann', 'text': '?'},
+        ]))
+        self.assertEqual((result['posts'], result['comments'], result['invalid']), (1, 0, 1))
+        self.assertFalse(Comment.objects.exists())
+        ids = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(len(set(ids)), 2)
+        self.assertGreater(ids[-1], ids[0])
+
+    def test_stale_record_does_not_resolve(self):
+        importer.Importer().run(iter([
+            {'type': 'post', 'id': 'p1', 'author': 'leo', 'text': 'пост'},
+        ]))
+        # Запись, указывающая на несуществующий пост.
+        ImportedRecord.objects.filter(external_id='p1').update(object_id=10 ** 6)
+        result = importer.Importer().run(iter([
+            {'type': 'comment', 'id': 'c1', 'post': 'p1', 'author': 'ann', 'text': '?'},
+        ]))
+        self.assertEqual((result['comments'], result['invalid']), (0, 1))
+
+    def test_csv_and_bad_lines(self):
+        path = self.write('dump.csv', [
+            'type,id,author,group,text,pub_date\n',
+            'post,p1,leo,cats,из csv,2019-05-01 10:00\n',
+            'post,p2,leo,,без группы,\n',
+        ])
+        call_command('import_content', path, stdout=io.StringIO())
+        self.assertEqual(Post.objects.filter(group=self.group).count(), 1)
+        self.assertEqual(Post.objects.count(), 2)
+        result = importer.Importer(source='other').run(
+            importer.read_jsonl(io.StringIO('{"type": "post"\n\n[]\n'))
+        )
+        self.assertEqual(result['invalid'], 2)
+
+    def test_command_resumes_from_checkpoint(self):
+        records = [
+            {'type': 'post', 'id': f'p{i}', 'author': 'leo', 'text': f'пост {i}'}
+            for i in range(5)
+        ]
+        path = self.write_jsonl(records)
+        with open(f'{path}.checkpoint', 'w') as fileobj:
+            json.dump({'source': 'import', 'records': 3}, fileobj)
+        out = io.StringIO()
+        call_command('import_content', path, '--batch-size', '1', stdout=out)
+        self.assertIn('Продолжаем с записи 3', out.getvalue())
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)), ['пост 3', 'пост 4']
+        )
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+        call_command('import_content', path, stdout=io.StringIO())
+        self.assertEqual(Post.objects.count(), 5)
+
+
+class TestExport(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(self.media.cleanup)
+        self.author = User.objects.create_user(username='leo', password='12345')
+        self.reader = User.objects.create_user(username='ann', password='12345')
+        group = Group.objects.create(title='Коты', slug='cats')
+        content = io.BytesIO()
+        Image.new('RGB', (16, 16)).save(content, format='jpeg')
+        self.post = Post.objects.create(
+            text='пост, с "кавычками"', author=self.author, group=group,
+            image=ContentFile(content.getvalue(), name='cat.jpg'),
+        )
+        Post.objects.create(text='второй', author=self.author)
+        Comment.objects.create(post=self.post, author=self.author, text='ответ')
+        Follow.objects.create(user=self.author, author=self.reader)
+
+    def download(self, **params):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('export', args=['leo']), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_round_trip(self):
+        response, body = self.download()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['post', 'post', 'comment', 'follow'])
+        self.assertEqual(rows[0]['group'], 'cats')
+        self.assertEqual(rows[3]['author'], 'ann')
+        result = importer.Importer(source='backup').run(iter(rows))
+        self.assertEqual((result['posts'], result['comments']), (2, 1))
+
+    def test_csv(self):
+        _, body = self.download(format='csv')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0]['text'], 'пост, с "кавычками"')
+        self.assertEqual(rows[2]['post'], str(self.post.pk))
+
+    def test_zip_with_images(self):
+        response, body = self.download(images='1')
+        self.assertIn('leo.zip', response['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(
+                archive.namelist(), ['leo.ndjson', f'images/{self.post.image.name}']
+            )
+            self.assertEqual(len(archive.read('leo.ndjson').splitlines()), 4)
+
+    def test_chunks_are_separate_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(export.records(self.author, chunk_size=1))
+        self.assertEqual(rows, list(export.records(self.author)))
+        # Каждый кусок - свой запрос с LIMIT, курсор не живёт между кусками.
+        post_reads = [q['sql'] for q in queries if 'FROM "posts_post"' in q['sql']]
+        self.assertEqual(len(post_reads), 3)
+        self.assertTrue(all('LIMIT 1' in sql for sql in post_reads))
+
+    def test_only_owner_or_staff(self):
+        url = reverse('export', args=['leo'])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.reader.is_staff = True
+        self.reader.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_content', 'leo', '--format', 'csv', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+        path = os.path.join(self.media.name, 'leo.zip')
+        call_command('export_content', 'leo', '--images', '--output', path)
+        self.assertTrue(zipfile.is_zipfile(path))
+
+
+class TestAPI(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='leo', password='12345')
+        self.reader = User.objects.create_user(username='ann', password='12345')
+        self.group = Group.objects.create(title='Коты', slug='cats', description='')
+        self.posts = [
+            Post.objects.create(text=f'пост {i}', author=self.author, group=self.group)
+            for i in range(5)
+        ]
+        Comment.objects.create(post=self.posts[0], author=self.reader, text='мяу')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_posts_cursor_and_fields(self):
+        url = reverse('post-list')
+        with self.assertNumQueries(1):
+            data = self.get(url, limit=2, fields='id,author,group')
+        self.assertEqual(data['results'], [
+            {'id': post.pk, 'author': 'leo', 'group': 'cats'}
+            for post in reversed(self.posts[3:])
+        ])
+        self.assertIsNone(data['previous'])
+        seen = [row['id'] for row in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            seen += [row['id'] for row in data['results']]
+        self.assertEqual(seen, [post.pk for post in reversed(self.posts)])
+        detail = self.get(reverse('post-detail', args=[self.posts[0].pk]))
+        self.assertEqual((detail['text'], detail['comment_count']), ('пост 0', 1))
+
+    def test_groups_profiles_comments(self):
+        self.assertEqual(self.get(reverse('group-list'))['results'][0]['slug'], 'cats')
+        group_posts = self.get(reverse('group-posts', args=['cats']))
+        self.assertEqual(len(group_posts['results']), 5)
+        profile = self.get(reverse('profile-detail', args=['leo']))
+        self.assertEqual((profile['username'], profile['posts_count']), ('leo', 5))
+        comments = self.get(reverse('post-comments', args=[self.posts[0].pk]))
+        self.assertEqual(
+            [(c['author'], c['text']) for c in comments['results']], [('ann', 'мяу')]
+        )
+        self.assertEqual(len(self.get(reverse('profile-posts', args=['leo']))['results']), 5)
+
+    def test_feed(self):
+        url = reverse('feed-list')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.get(url)['results'], [])
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(len(self.get(url)['results']), 5)
+
+    def test_etag(self):
+        url = reverse('post-list')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text='новый', author=self.author)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.force_login(self.reader)
+        feed = reverse('feed-list')
+        etag = self.client.get(feed)['ETag']
+        self.assertEqual(self.client.get(feed, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.client.get(feed, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        profile = reverse('profile-detail', args=['leo'])
+        etag = self.client.get(profile)['ETag']
+        self.author.first_name = 'Лев'
+        self.author.save()
+        response = self.client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['first_name']), (200, 'Лев'))
@@ -0,0 +1,291 @@
+"""Миниатюры постов, подготовленные заранее.
+
+Картинку поста нарезают в нескольких ширинах и форматах (WebP и JPEG,
+настройка POST_IMAGE_VARIANTS). Делает это пул потоков сразу после
+сохранения поста, а не первый зритель. Список готовых вариантов
+(манифест) хранится в Post.image_variants, поэтому шаблон строит
+srcset из строки поста без обращений к хранилищу и, пока манифеста
+нет, показывает заглушку. Когда варианты готовы, версия поста растёт,
+и кэшированные карточки пересобираются.
+
+Размеры исходника и крошечное превью (LQIP) для заглушки вычисляются
+при сохранении поста и хранятся в его строке.
+"""
+import base64
+import io
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+from sorl.thumbnail import default, get_thumbnail
+
+from . import caching
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Пропорции картинки в карточке поста (960x339).
+CARD_RATIO = 339 / 960
+DEFAULT_VARIANTS = {
+    'widths': (480, 960),
+    'formats': ('webp', 'jpeg'),
+    'sizes': '(min-width: 992px) 960px, 100vw',
+}
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+# Превью для заглушки: несколько сотен байт, браузер сам его размоет.
+PLACEHOLDER_SIZE = (24, 8)
+PLACEHOLDER_QUALITY = 30
+EXIF_ORIENTATION = 0x0112
+
+Variant = namedtuple('Variant', 'width height format geometry options')
+
+WORKERS = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+QUEUED_TIMEOUT = 60 * 10
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def variant_config():
+    return {**DEFAULT_VARIANTS, **getattr(settings, 'POST_IMAGE_VARIANTS', {})}
+
+
+def variant_specs():
+    """Варианты картинки, которые нужно подготовить по настройкам."""
+    config = variant_config()
+    specs = []
+    for fmt in config['formats']:
+        for width in sorted(config['widths']):
+            height = round(width * CARD_RATIO)
+            options = {'crop': 'center', 'upscale': True, 'format': fmt.upper()}
+            specs.append(Variant(width, height, fmt, f'{width}x{height}', options))
+    return specs
+
+
+def _spec_signature():
+    config = variant_config()
+    return '{}|{}'.format(
+        ','.join(map(str, sorted(config['widths']))),
+        ','.join(config['formats']),
+    )
+
+
+def manifest(post):
+    """Манифест вариантов картинки поста или None, если он устарел.
+
+    Манифест устаревает при замене картинки и при смене набора
+    вариантов в настройках.
+    """
+    if not post.image or not post.image_variants:
+        return None
+    data = json.loads(post.image_variants)
+    if data['source'] != post.image.name or data['spec'] != _spec_signature():
+        return None
+    return data
+
+
+def image_sources(post):
+    """Атрибуты <picture> для карточки: srcset по форматам и запасной src."""
+    data = manifest(post)
+    if data is None:
+        return None
+    storage = default.storage
+    srcsets = {}
+    for variant in data['variants']:
+        srcsets.setdefault(variant['format'], []).append(
+            '{} {}w'.format(storage.url(variant['name']), variant['width'])
+        )
+    fallback = [v for v in data['variants'] if v['format'] == 'jpeg']
+    fallback = max(fallback or data['variants'], key=lambda v: v['width'])
+    return {
+        'sources': [
+            {'type': MIME_TYPES.get(fmt, f'image/{fmt}'), 'srcset': ', '.join(items)}
+            for fmt, items in srcsets.items() if fmt != fallback['format']
+        ],
+        'srcset': ', '.join(srcsets[fallback['format']]),
+        'src': storage.url(fallback['name']),
+        'sizes': variant_config()['sizes'],
+        'width': fallback['width'],
+        'height': fallback['height'],
+    }
+
+
+def describe(fileobj):
+    """Размеры картинки и превью-заглушка в виде data URI."""
+    fileobj.seek(0)
+    with Image.open(fileobj) as image:
+        width, height = image.size
+        # Ориентации 5-8 по EXIF - поворот на 90°: ширина и высота меняются.
+        if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз.
+        image.draft('RGB', (PLACEHOLDER_SIZE[0] * 4, PLACEHOLDER_SIZE[1] * 4))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        tiny = ImageOps.fit(image, PLACEHOLDER_SIZE)
+    fileobj.seek(0)
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+    return width, height, placeholder
+
+
+def fill_metadata(post, fileobj):
+    try:
+        post.image_width, post.image_height, post.image_placeholder = (
+            describe(fileobj)
+        )
+    except OSError:
+        logger.warning('Не удалось прочитать картинку %s', post.image.name)
+        clear_metadata(post)
+
+
+def clear_metadata(post):
+    post.image_width = post.image_height = None
+    post.image_placeholder = ''
+
+
+def build_variants(post):
+    """Нарезает варианты картинки и возвращает манифест в виде JSON.
+
+    Уже нарезанные sorl-thumbnail берёт из своего хранилища. Возвращает
+    None, если исходник не удалось открыть.
+    """
+    variants = []
+    for spec in variant_specs():
+        thumbnail = get_thumbnail(post.image, spec.geometry, **spec.options)
+        if default.kvstore.get(thumbnail) is None:
+            logger.warning('Не удалось создать миниатюру %s', post.image.name)
+            return None
+        variants.append({
+            'width': spec.width,
+            'height': spec.height,
+            'format': spec.format,
+            'name': thumbnail.name,
+        })
+    return json.dumps({
+        'source': post.image.name,
+        'spec': _spec_signature(),
+        'variants': variants,
+    })
+
+
+def generate(post_id, force=False):
+    """Готовит варианты картинки поста и увеличивает его версию.
+
+    Возвращает False, если поста нет или изображение не удалось открыть.
+    """
+    post = Post.objects.filter(pk=post_id).only(
+        'image', 'image_variants', 'image_width'
+    ).first()
+    if post is None or not post.image:
+        return False
+    if not force and manifest(post) is not None:
+        return True
+    variants = build_variants(post)
+    if variants is None:
+        return False
+    fields = {'image_variants': variants}
+    if post.image_width is None:
+        # Пост сохранён в обход формы - размеры и превью досчитываем здесь.
+        with post.image.open('rb') as fileobj:
+            fields.update(zip(
+                ('image_width', 'image_height', 'image_placeholder'),
+                describe(fileobj),
+            ))
+    # Картинку могли заменить, пока шла нарезка, - тогда манифест не нужен.
+    Post.objects.filter(pk=post_id, image=post.image.name).update(
+        version=F('version') + 1, **fields
+    )
+    caching.bump_generation()
+    return True
+
+
+def backfill(chunk_size=500, force=False):
+    """Готовит варианты для всех постов с картинкой, идя по id пачками.
+
+    Возвращает число подготовленных постов и постов, чьи картинки не
+    удалось открыть.
+    """
+    built = failed = 0
+    last_pk = 0
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last_pk).exclude(image='')
+            .exclude(image__isnull=True).order_by('pk')
+            .only('image', 'image_variants')[:chunk_size]
+        )
+        if not posts:
+            break
+        last_pk = posts[-1].pk
+        for post in posts:
+            if not force and manifest(post) is not None:
+                continue
+            if generate(post.pk, force=force):
+                built += 1
+            else:
+                failed += 1
+    return built, failed
+
+
+def _queued_key(post_id):
+    return f'thumbnail:queued:{post_id}'
+
+
+def _run(post_id):
+    try:
+        if generate(post_id):
+            cache.delete(_queued_key(post_id))
+    except Exception:
+        # Ключ очереди остаётся: повторная попытка - не раньше
+        # QUEUED_TIMEOUT.
+        logger.exception('Ошибка при создании миниатюр поста %s', post_id)
+
+
+def _work(post_id):
+    try:
+        _run(post_id)
+    finally:
+        connections.close_all()
+
+
+def _executor():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Потоки пула не переживают fork воркера.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                WORKERS, thread_name_prefix='thumbnails'
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def enqueue(post_id):
+    """Ставит создание миниатюр в пул; уже стоящий в очереди пост пропускает.
+
+    С THUMBNAIL_ASYNC = False миниатюры создаются сразу.
+    """
+    if not cache.add(_queued_key(post_id), 1, QUEUED_TIMEOUT):
+        return
+    if getattr(settings, 'THUMBNAIL_ASYNC', True):
+        _executor().submit(_work, post_id)
+    else:
+        _run(post_id)
+
+
+def schedule(post):
+    """Создаёт миниатюры после фиксации транзакции, в которой сохранён пост."""
+    if post.image:
+        transaction.on_commit(lambda: enqueue(post.pk))
@@ -0,0 +1,163 @@
+"""Лента подписок с доставкой постов при записи (fan-out-on-write).
+
+Новый пост раскладывается по лентам подписчиков автора, поэтому
+follow_index читает готовый список по индексу (user, pub_date). Посты
+авторов с очень большим числом подписчиков не раскладываются, а
+подмешиваются в ленту при чтении.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .pagination import MergedCursorPaginator, POSTS_PER_PAGE
+
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+BACKFILL_LIMIT = getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 1000)
+BATCH_SIZE = 500
+CELEBRITY_TIMEOUT = 60 * 10
+
+
+def enabled():
+    """Ленты раскладываются при записи, только если их читает follow_index."""
+    return getattr(settings, 'FEED_ENGINE', 'timeline') == 'timeline'
+
+
+def _celebrity_key(author_id):
+    return f'timeline:celebrity:{author_id}'
+
+
+def _over_limit(author_ids):
+    return UserStats.objects.filter(
+        user_id__in=author_ids, followers_count__gt=FANOUT_LIMIT
+    ).values_list('user_id', flat=True)
+
+
+def is_celebrity(author_id):
+    """Автор, посты которого не раскладываются по лентам подписчиков."""
+    key = _celebrity_key(author_id)
+    flag = cache.get(key)
+    if flag is None:
+        flag = _over_limit([author_id]).exists()
+        cache.set(key, flag, CELEBRITY_TIMEOUT)
+    return flag
+
+
+def celebrity_authors(author_ids):
+    author_ids = list(author_ids)
+    flags = cache.get_many([_celebrity_key(pk) for pk in author_ids])
+    missing = [pk for pk in author_ids if _celebrity_key(pk) not in flags]
+    if missing:
+        # Флаги для всех некэшированных авторов одним запросом.
+        over_limit = set(_over_limit(missing))
+        fresh = {_celebrity_key(pk): pk in over_limit for pk in missing}
+        cache.set_many(fresh, CELEBRITY_TIMEOUT)
+        flags.update(fresh)
+    return [pk for pk in author_ids if flags[_celebrity_key(pk)]]
+
+
+def forget_celebrities(author_ids):
+    """Сбрасывает закэшированные признаки знаменитостей авторов."""
+    cache.delete_many([_celebrity_key(pk) for pk in author_ids])
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out(post):
+    """Доставляет новый пост в ленты всех подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    )
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(TimelineEntry(
+            user_id=user_id,
+            post_id=post.pk,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        ))
+        if len(batch) == BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    if batch:
+        _bulk_insert(batch)
+
+
+def fan_out_many(posts):
+    """Доставляет пачку постов (например, импортированных) в ленты.
+
+    Подписчики всех авторов пачки читаются одним запросом. Посту
+    достаточно полей id, author_id и pub_date.
+    """
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.author_id, []).append(post)
+    celebrities = set(celebrity_authors(by_author))
+    followers = Follow.objects.filter(
+        author_id__in=[pk for pk in by_author if pk not in celebrities]
+    ).values_list('user_id', 'author_id')
+    batch = []
+    for user_id, author_id in followers.iterator():
+        for post in by_author[author_id]:
+            batch.append(TimelineEntry(
+                user_id=user_id,
+                post_id=post.id,
+                author_id=author_id,
+                pub_date=post.pub_date,
+            ))
+        if len(batch) >= BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    if batch:
+        _bulk_insert(batch)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту нового подписчика последние посты автора."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:BACKFILL_LIMIT]
+    _bulk_insert([
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for post_id, pub_date in posts
+    ])
+
+
+def drop(user_id, author_id):
+    """Убирает из ленты посты автора, от которого пользователь отписался."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild():
+    """Заново собирает ленты всех подписчиков по таблице подписок."""
+    TimelineEntry.objects.all().delete()
+    follows = Follow.objects.values_list('user_id', 'author_id')
+    for user_id, author_id in follows.iterator():
+        backfill(user_id, author_id)
+
+
+def timeline_paginator(user, per_page=POSTS_PER_PAGE):
+    followed = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
+    sources = [
+        (TimelineEntry.objects.filter(user=user), ('pub_date', 'post_id')),
+    ]
+    celebrities = celebrity_authors(followed)
+    if celebrities:
+        sources.append(
+            (Post.objects.filter(author_id__in=celebrities), ('pub_date', 'id'))
+        )
+    return MergedCursorPaginator(Post.objects.for_feed(), sources, per_page)
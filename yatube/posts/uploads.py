@@ -0,0 +1,83 @@
+"""Обработка загруженных картинок постов.
+
+До декодирования проверяются размер файла, формат и число пикселей из
+заголовка, поэтому «бомба» не раскрывается в памяти воркера. JPEG
+декодируется сразу уменьшенным (draft), картинка приводится к
+MAX_DIMENSION по длинной стороне, поворачивается по EXIF и теряет
+метаданные (EXIF, комментарии; цветовой профиль сохраняется). Результат
+пишется прогрессивным JPEG или PNG, если у картинки есть прозрачность.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.utils.translation import gettext_lazy as _
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_SIZE = getattr(settings, 'POST_IMAGE_MAX_UPLOAD_SIZE', 20 * 1024 * 1024)
+MAX_PIXELS = getattr(settings, 'POST_IMAGE_MAX_PIXELS', 25_000_000)
+MAX_DIMENSION = getattr(settings, 'POST_IMAGE_MAX_DIMENSION', 2048)
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+JPEG_QUALITY = 85
+
+
+def _fit(size):
+    """Размер, вписанный в квадрат MAX_DIMENSION с сохранением пропорций."""
+    width, height = size
+    scale = min(1, MAX_DIMENSION / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def process_image(upload):
+    """Проверяет загруженную картинку и возвращает её очищенную копию."""
+    if upload.size > MAX_UPLOAD_SIZE:
+        raise ValidationError(
+            _('Файл больше %(limit)d МБ.'),
+            code='file_too_large',
+            params={'limit': MAX_UPLOAD_SIZE // (1024 * 1024)},
+        )
+    upload.seek(0)
+    try:
+        # open читает только заголовок; пиксели декодируются в load.
+        image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(_('Не удалось прочитать изображение.'),
+                              code='invalid_image')
+    with image:
+        if image.format not in ALLOWED_FORMATS:
+            raise ValidationError(
+                _('Формат %(format)s не поддерживается.'),
+                code='invalid_format', params={'format': image.format},
+            )
+        width, height = image.size
+        if width * height > MAX_PIXELS:
+            raise ValidationError(
+                _('Изображение больше %(limit)d мегапикселей.'),
+                code='too_many_pixels',
+                params={'limit': MAX_PIXELS // 1_000_000},
+            )
+        target = _fit(image.size)
+        image.draft(None, target)
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(_fit(image.size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if _has_alpha(image):
+            image.convert('RGBA').save(buffer, 'PNG', optimize=True)
+            extension = '.png'
+        else:
+            image.convert('RGB').save(
+                buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                progressive=True, icc_profile=icc_profile,
+            )
+            extension = '.jpg'
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return ContentFile(buffer.getvalue(), name=name)
@@ -4,8 +4,11 @@ from . import views
 
 urlpatterns = [
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search_posts, name="search"),
+    path("autocomplete/<str:kind>/", views.suggest, name="autocomplete"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
+    path("<str:username>/export/", views.export_data, name="export"),
     path("", views.index, name="index"),
     path("group/<slug:slug>/", views.group_posts, name="group_posts"),
     path("new/", views.new_post, name="new_post"),
@@ -1,19 +1,25 @@
-from django.views.decorators.cache import cache_page
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
 from django.views.generic import CreateView
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, render, get_object_or_404
-from django.core.paginator import Paginator
+from django.db import transaction
 
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
+from .pagination import paginate
+from . import autocomplete, export, feeds, search, stats, thumbnails
+from .caching import (
+    cache_feed_page, feed_etag, last_modified, post_etag, profile_etag,
+)
+from .templatetags.post_cards import prefetch_cards
 
 
-@cache_page(20, key_prefix='index_page')
+@cache_feed_page('index_page')
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    paginator, page = paginate(request, post_list)
+    prefetch_cards(page)
     return render(
         request,
         'index.html',
@@ -21,12 +27,12 @@ def index(request):
     )
 
 
+@condition(etag_func=feed_etag, last_modified_func=last_modified)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = group.posts.for_feed()
+    paginator, page = paginate(request, post_list)
+    prefetch_cards(page)
     return render(
         request,
         'group.html',
@@ -34,6 +40,26 @@ def group_posts(request, slug):
     )
 
 
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    paginator, page = search.search(request, Post.objects.for_feed(), query)
+    prefetch_cards(page)
+    return render(
+        request,
+        'search.html',
+        {'query': query, 'page': page, 'paginator': paginator}
+    )
+
+
+def suggest(request, kind):
+    catalog = autocomplete.CATALOGS.get(kind)
+    if catalog is None:
+        raise Http404
+    query = request.GET.get('q', '').strip()
+    results = catalog.search(query) if query else []
+    return JsonResponse({'results': results})
+
+
 class PostNew(CreateView):
     form_class = PostForm
     success_url = ""
@@ -47,27 +73,27 @@ def new_post(request):
         return render(request, 'new.html', {'form': form})
     post = form.save(commit=False)
     post.author = request.user
-    post.save()
+    # Пост и его раскладка по лентам подписчиков сохраняются вместе.
+    with transaction.atomic():
+        post.save()
+        thumbnails.schedule(post)
     return redirect('index')
 
 
+@condition(etag_func=profile_etag, last_modified_func=last_modified)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts_user.all()
-    count = post_list.count()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related('stats'), username=username)
+    author_stats = stats.get_stats(author)
+    count = author_stats.posts_count
+    paginator, page = paginate(request, author.posts_user.for_feed())
+    prefetch_cards(page)
     if request.user.is_anonymous:
         context = dict(author=author, page=page, paginator=paginator, count=count)
     else:
         user = request.user
-        followers = Follow.objects.filter(author=author).count()
-        subscriptions = Follow.objects.filter(user=author).count()
-        if Follow.objects.filter(author=author, user=user).count() != 0:
-            following = True
-        else:
-            following = False
+        followers = author_stats.followers_count
+        subscriptions = author_stats.following_count
+        following = Follow.objects.filter(author=author, user=user).exists()
         flag_user = True
         if author == user:
             flag_user = False
@@ -77,16 +103,19 @@ def profile(request, username):
     return render(request, 'profile.html', context)
 
 
+@condition(etag_func=post_etag, last_modified_func=last_modified)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    post = get_object_or_404(
+        Post.objects.for_feed(), pk=post_id, author__username=username
+    )
     user = request.user
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts_user.all()
-    items = post.comments.all()
-    count = post_list.count()
+    author = get_object_or_404(User.objects.select_related('stats'), username=username)
+    author_stats = stats.get_stats(author)
+    items = post.comments.select_related('author')
+    count = author_stats.posts_count
     form = CommentForm(instance=None)
-    followers = Follow.objects.filter(author=author).count()
-    subscriptions = Follow.objects.filter(user=author).count()
+    followers = author_stats.followers_count
+    subscriptions = author_stats.following_count
     context = dict(user=user, post=post, author=author, count=count, items=items, form=form,
                    subscriptions=subscriptions, followers=followers)
     return render(request, 'post.html', context)
@@ -101,7 +130,9 @@ def add_comment(request, username, post_id):
     comment = form.save(commit=False)
     comment.post = post
     comment.author = request.user
-    comment.save()
+    # Комментарий и счётчик комментариев поста сохраняются вместе.
+    with transaction.atomic():
+        comment.save()
     return redirect('post', username=username, post_id=post_id)
 
 
@@ -117,7 +148,9 @@ def post_edit(request, username, post_id):
         return render(request, 'new.html', {'form': form, 'post': post, 'user': post.author, 'flag': flag})
     post = form.save(commit=False)
     post.author = request.user
-    post.save()
+    with transaction.atomic():
+        post.save()
+        thumbnails.schedule(post)
     return redirect('post', username=username, post_id=post_id)
 
 
@@ -136,10 +169,9 @@ def server_error(request):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator = feeds.follow_paginator(request.user)
+    page = paginator.page_for_request(request)
+    prefetch_cards(page)
     return render(
         request,
         'follow.html',
@@ -155,8 +187,8 @@ def profile_follow(request, username):
         return redirect('profile', username=author.username)
     if follower.follower.filter(author=author).exists():
         return redirect('profile', username=author.username)
-    follow = Follow.objects.create(user=follower, author=author)
-    follow.save()
+    with transaction.atomic():
+        Follow.objects.create(user=follower, author=author)
     return redirect('profile', username=username)
 
 
@@ -164,6 +196,26 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follower = get_object_or_404(User, username=request.user.username)
-    Follow.objects.filter(user=follower, author=author).delete()
+    with transaction.atomic():
+        Follow.objects.filter(user=follower, author=author).delete()
     return redirect('profile', username=username)
 
+
+@login_required
+def export_data(request, username):
+    """Выгрузка своих данных; персонал может выгрузить любого."""
+    author = get_object_or_404(User, username=username)
+    if author != request.user and not request.user.is_staff:
+        raise Http404
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        raise Http404
+    images = request.GET.get('images') == '1'
+    response = StreamingHttpResponse(
+        export.stream(author, fmt, images),
+        content_type=export.content_type(fmt, images),
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{export.filename(author, fmt, images)}"'
+    )
+    return response
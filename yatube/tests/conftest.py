@@ -1,4 +1,14 @@
+import pytest
+
+from yatube.test_runner import temporary_cache
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_cache():
+    with temporary_cache():
+        yield
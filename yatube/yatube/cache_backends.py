@@ -0,0 +1,532 @@
+"""Бэкенды кэша: общий SQLiteCache и двухуровневый TwoLevelCache.
+
+SQLiteCache - кэш в файле SQLite, общий для всех процессов на машине.
+
+Воркеры gunicorn видят одни и те же записи, поэтому кэш не остывает
+при добавлении воркеров, а инвалидация доходит до всех процессов.
+Внешний сервис не нужен: база работает в режиме WAL, запись идёт
+короткими транзакциями BEGIN IMMEDIATE, так что add и incr атомарны.
+Объём ограничен числом записей (MAX_ENTRIES) и байтами (MAX_BYTES):
+при превышении сначала удаляются просроченные записи, затем давно не
+читанные (LRU).
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache_backends.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_BYTES': 256 * 1024 * 1024},
+        }
+    }
+
+TwoLevelCache держит горячие ключи в LRU внутри процесса (L1) перед
+общим кэшем (L2). Каждая запись через него увеличивает версию в L2 и
+пишет в журнал, какие ключи изменились; процесс сверяется с версией не
+чаще раза в CHECK_INTERVAL секунд и выбрасывает из L1 изменённые ключи.
+Так чужая запись становится видна не позже чем через CHECK_INTERVAL,
+а запись с истёкшим в L2 сроком - не позже чем через MAX_AGE.
+"""
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS cache_usage (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_usage VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_usage SET entries = entries + 1, bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN
+    UPDATE cache_usage SET bytes = bytes + NEW.size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_usage SET entries = entries - 1, bytes = bytes - OLD.size;
+END;
+'''
+
+UPSERT = '''
+INSERT INTO cache (key, value, expires, accessed, size)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value,
+    expires = excluded.expires,
+    accessed = excluded.accessed,
+    size = excluded.size
+'''
+
+# Ограничение SQLite на число параметров запроса.
+MAX_PARAMS = 500
+
+
+def _alive(expires, now):
+    return expires is None or expires > now
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        # Время последнего чтения обновляем не чаще раза в TOUCH_INTERVAL
+        # секунд, чтобы чтения не превращались в запись.
+        self._touch_interval = options.get('TOUCH_INTERVAL', 10)
+        self._lock_timeout = options.get('LOCK_TIMEOUT', 30)
+        self._poll_interval = options.get('POLL_INTERVAL', 0.05)
+        self._local = threading.local()
+
+    def _connection(self):
+        # После fork соединение родителя использовать нельзя.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(
+                self._path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _row(self, conn, key, now):
+        row = conn.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or not _alive(row[1], now):
+            return None
+        return row
+
+    def _put(self, conn, key, value, timeout, now):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        conn.execute(UPSERT, (
+            key, blob, self.get_backend_timeout(timeout), now, len(blob),
+        ))
+
+    def _over_budget(self, conn):
+        entries, size = conn.execute(
+            'SELECT entries, bytes FROM cache_usage'
+        ).fetchone()
+        over = entries > self._max_entries or size > self._max_bytes
+        return over, entries
+
+    def _cull(self, conn, now):
+        over, entries = self._over_budget(conn)
+        if not over:
+            return
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        over, entries = self._over_budget(conn)
+        while over and entries:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (max(1, entries // self._cull_frequency),),
+            )
+            over, entries = self._over_budget(conn)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        conn = self._connection()
+        now = time.time()
+        row = self._row(conn, key, now)
+        if row is None:
+            return default
+        if now - row[2] > self._touch_interval:
+            conn.execute(
+                'UPDATE cache SET accessed = ? WHERE key = ?', (now, key)
+            )
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        made = list(keys)
+        conn = self._connection()
+        now = time.time()
+        result = {}
+        for start in range(0, len(made), MAX_PARAMS):
+            chunk = made[start:start + MAX_PARAMS]
+            rows = conn.execute(
+                'SELECT key, value, expires, accessed FROM cache WHERE key IN (%s)'
+                % ', '.join('?' * len(chunk)),
+                chunk,
+            ).fetchall()
+            # Как в get(): прочитанные ключи не должны вытесняться первыми.
+            touched = []
+            for key, value, expires, accessed in rows:
+                if _alive(expires, now):
+                    result[keys[key]] = pickle.loads(value)
+                    if now - accessed > self._touch_interval:
+                        touched.append(key)
+            if touched:
+                conn.execute(
+                    'UPDATE cache SET accessed = ? WHERE key IN (%s)'
+                    % ', '.join('?' * len(touched)),
+                    [now, *touched],
+                )
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            self._put(conn, key, value, timeout, now)
+            self._cull(conn, now)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        with self._write() as conn:
+            for key, value in data.items():
+                self._put(conn, self._key(key, version), value, timeout, now)
+            self._cull(conn, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            if self._row(conn, key, now) is not None:
+                return False
+            self._put(conn, key, value, timeout, now)
+            self._cull(conn, now)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            row = self._row(conn, key, now)
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                'UPDATE cache SET value = ?, size = ?, accessed = ? '
+                'WHERE key = ?',
+                (blob, len(blob), now, key),
+            )
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write() as conn:
+            updated = conn.execute(
+                'UPDATE cache SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, now),
+            ).rowcount
+        return updated == 1
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._row(self._connection(), key, time.time()) is not None
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        with self._write() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        with self._write() as conn:
+            conn.executemany(
+                'DELETE FROM cache WHERE key = ?',
+                [(self._key(key, version),) for key in keys],
+            )
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Как в BaseCache, но отсутствующее значение вычисляет один процесс.
+
+        Остальные ждут, пока оно появится в кэше, но не дольше
+        LOCK_TIMEOUT секунд, после чего вычисляют сами.
+        """
+        if not callable(default):
+            return super().get_or_set(key, default, timeout, version)
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + self._lock_timeout
+        while True:
+            value = self.get(key, version=version)
+            if value is not None:
+                return value
+            if self.add(lock_key, os.getpid(), self._lock_timeout, version):
+                try:
+                    value = default()
+                    if value is not None:
+                        self.set(key, value, timeout, version)
+                    return value
+                finally:
+                    self.delete(lock_key, version)
+            if time.monotonic() >= deadline:
+                return default()
+            time.sleep(self._poll_interval)
+
+
+VERSION_KEY = 'l1:version'
+CHANGED_KEY = 'l1:changed:%d'
+# Сколько записей журнала процесс готов дочитать; при большем отставании
+# проще очистить L1 целиком.
+LOG_WINDOW = 1000
+LOG_TIMEOUT = 60 * 5
+# Неизменяемые значения L1 отдаёт как есть, остальные хранит
+# сериализованными, чтобы запросы не делили один изменяемый объект.
+IMMUTABLE = (bool, int, float, str, bytes)
+
+_missing = object()
+_stores = {}
+
+
+class LocalLRU:
+    """LRU процесса, ограниченный числом записей и байтами."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = None
+        self.checked = float('-inf')
+        # Растёт при каждом удалении: значение, прочитанное из L2 до
+        # удаления, не должно вернуться в L1 после него.
+        self.seq = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _missing
+            expires, size, payload, packed = entry
+            if expires <= time.monotonic():
+                self._pop(key)
+                return _missing
+            self._data.move_to_end(key)
+        return pickle.loads(payload) if packed else payload
+
+    def put(self, key, value, max_age, seq):
+        packed = not isinstance(value, IMMUTABLE)
+        if packed:
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            size = len(payload)
+        else:
+            payload, size = value, sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if seq != self.seq:
+                return
+            self._pop(key)
+            self._data[key] = (time.monotonic() + max_age, size, payload, packed)
+            self._bytes += size
+            while (len(self._data) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def discard(self, keys):
+        with self._lock:
+            self.seq += 1
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self.seq += 1
+            self._data.clear()
+            self._bytes = 0
+
+
+class TwoLevelCache(BaseCache):
+    """LRU процесса перед кэшем CACHES[LOCATION] (по умолчанию 'shared')."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._alias = location or 'shared'
+        self._check_interval = options.get('CHECK_INTERVAL', 1)
+        self._max_age = options.get('MAX_AGE', 30)
+        # Django создаёт экземпляр бэкенда на поток, а L1 общий на процесс.
+        self._store = _stores.setdefault(self._alias, LocalLRU(
+            self._max_entries,
+            int(options.get('MAX_BYTES', 16 * 1024 * 1024)),
+        ))
+
+    @property
+    def _shared(self):
+        return caches[self._alias]
+
+    def _current_version(self):
+        version = self._shared.get(VERSION_KEY)
+        if version is None:
+            # Не с единицы, как и поколение ленты: после вытеснения
+            # ключа версия не должна совпасть с той, что видели процессы.
+            self._shared.add(VERSION_KEY, int(time.time() * 1000), None)
+            version = self._shared.get(VERSION_KEY)
+        return version
+
+    def _sync(self):
+        store = self._store
+        now = time.monotonic()
+        if now - store.checked < self._check_interval:
+            return
+        store.checked = now
+        current, last = self._current_version(), store.version
+        if last is None or not 0 <= current - last <= LOG_WINDOW:
+            store.clear()
+        elif current > last:
+            changed = self._shared.get_many(
+                [CHANGED_KEY % v for v in range(last + 1, current + 1)]
+            )
+            if len(changed) < current - last or None in changed.values():
+                store.clear()
+            else:
+                store.discard(
+                    key for keys in changed.values() for key in keys
+                )
+        store.version = current
+
+    def _publish(self, keys):
+        """Сообщает остальным процессам, что ключи изменились."""
+        self._store.discard(keys)
+        try:
+            version = self._shared.incr(VERSION_KEY)
+        except ValueError:
+            version = self._current_version()
+        self._shared.set(CHANGED_KEY % version, keys, LOG_TIMEOUT)
+
+    def _local_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        local_key = self._local_key(key, version)
+        value = self._store.get(local_key)
+        if value is not _missing:
+            return value
+        seq = self._store.seq
+        value = self._shared.get(key, _missing, version)
+        if value is _missing:
+            return default
+        self._store.put(local_key, value, self._max_age, seq)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        result, rest = {}, {}
+        for key in keys:
+            local_key = self._local_key(key, version)
+            value = self._store.get(local_key)
+            if value is _missing:
+                rest[key] = local_key
+            else:
+                result[key] = value
+        if rest:
+            seq = self._store.seq
+            fetched = self._shared.get_many(list(rest), version)
+            for key, value in fetched.items():
+                self._store.put(rest[key], value, self._max_age, seq)
+            result.update(fetched)
+        return result
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version) is not _missing
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._shared.set(key, value, self._timeout(timeout), version)
+        self._publish([self._local_key(key, version)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._shared.set_many(data, self._timeout(timeout), version)
+        self._publish([self._local_key(key, version) for key in data])
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._shared.add(key, value, self._timeout(timeout), version)
+        if added:
+            self._publish([self._local_key(key, version)])
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self._shared.incr(key, delta, version)
+        self._publish([self._local_key(key, version)])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._shared.touch(key, self._timeout(timeout), version)
+
+    def delete(self, key, version=None):
+        self._shared.delete(key, version)
+        self._publish([self._local_key(key, version)])
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._shared.delete_many(keys, version)
+        self._publish([self._local_key(key, version) for key in keys])
+
+    def clear(self):
+        # Очистка стирает и версию; новая должна быть больше прежней,
+        # иначе другие процессы не заметят изменений.
+        version = self._current_version() + 1
+        self._shared.clear()
+        self._store.clear()
+        self._shared.set(VERSION_KEY, version, None)
+        self._shared.set(CHANGED_KEY % version, None, LOG_TIMEOUT)
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            # Вычисление с защитой от наплыва - на стороне общего кэша.
+            value = self._shared.get_or_set(
+                key, default, self._timeout(timeout), version
+            )
+            self._publish([self._local_key(key, version)])
+        return value
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
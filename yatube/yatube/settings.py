@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'sorl.thumbnail',
+    'rest_framework',
     'debug_toolbar',
 ]
 
@@ -156,9 +158,35 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 # Идентификатор текущего сайта
 SITE_ID = 1
 
+TEST_RUNNER = 'yatube.test_runner.TestRunner'
+
+# Горячие ключи в памяти процесса поверх общего для всех воркеров кэша
+# в файле SQLite (см. yatube/cache_backends.py). Файл лежит вне дерева
+# исходников; путь задаётся YATUBE_CACHE_PATH. Тесты подменяют его
+# временным файлом (yatube/test_runner.py).
+CACHE_PATH = os.environ.get(
+    'YATUBE_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'yatube-cache.sqlite3'),
+)
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.cache_backends.TwoLevelCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'MAX_BYTES': 32 * 1024 * 1024,
+            'CHECK_INTERVAL': 1,
+            'MAX_AGE': 30,
+        },
+    },
+    'shared': {
+        'BACKEND': 'yatube.cache_backends.SQLiteCache',
+        'LOCATION': CACHE_PATH,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 256 * 1024 * 1024,
+        },
     }
 }
 
@@ -166,4 +194,37 @@ ALLOWED_HOSTS = [
         "*",
     ]
 
+# Страницы ленты кэшируются до изменения контента (см. posts/caching.py);
+# устаревшую страницу пересобирает один запрос, остальные получают прежнюю
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+FEED_CACHE_STALE_WHILE_REVALIDATE = True
+# Отрисованные карточки постов (ключ включает версию поста)
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Движок ленты подписок: "timeline" (раскладка при публикации),
+# "pull" (слияние списков последних постов авторов при чтении) или "join".
+# При переключении на "timeline" ленты собираются командой rebuild_timelines
+FEED_ENGINE = "timeline"
+# Лента подписок: авторы с большим числом подписчиков не раскладываются
+# по лентам при публикации, а подмешиваются при чтении
+TIMELINE_FANOUT_LIMIT = 10000
+# Сколько последних постов автора попадает в ленту при подписке
+TIMELINE_BACKFILL_LIMIT = 1000
+
+# Миниатюры создаются пулом потоков после сохранения поста
+# (posts/thumbnails.py); False - сразу, в том же потоке
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+# Ширины и форматы картинки поста для srcset; после изменения варианты
+# пересобирает команда build_image_variants
+POST_IMAGE_VARIANTS = {
+    'widths': [320, 640, 960],
+    'formats': ['webp', 'jpeg'],
+    'sizes': '(min-width: 992px) 960px, 100vw',
+}
 
+# Ограничения загружаемых картинок постов (posts/uploads.py): файлы
+# больше FILE_UPLOAD_MAX_MEMORY_SIZE Django пишет во временный файл
+POST_IMAGE_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 25000000
+POST_IMAGE_MAX_DIMENSION = 2048
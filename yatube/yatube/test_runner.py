@@ -0,0 +1,39 @@
+"""Тесты работают со своим временным файлом общего кэша.
+
+Тесты чистят кэш в setUp, поэтому файл из CACHE_PATH, общий с
+запущенным сайтом, им не подходит. manage.py test берёт раннер из
+TEST_RUNNER, pytest - фикстуру из tests/conftest.py.
+"""
+import copy
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+@contextmanager
+def temporary_cache():
+    """Подменяет файл кэша 'shared' временным на время блока."""
+    directory = tempfile.mkdtemp(prefix='yatube-test-cache-')
+    caches = copy.deepcopy(settings.CACHES)
+    caches['shared']['LOCATION'] = os.path.join(directory, 'cache.sqlite3')
+    try:
+        with override_settings(CACHES=caches):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache = temporary_cache()
+        self._cache.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -22,7 +22,9 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     # REST framework login and logout views:
-    # path(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    # API только для чтения:
+    path('api/v1/', include('posts.api')),
     # Импортируем flatpages:
     path('about/', include('django.contrib.flatpages.urls')),
     # Созданные flatpages: